@@ -0,0 +1,125 @@
+"""
+This script holds the command queue that sits between the GUI and the motors.
+
+Every actuator gets one long lived worker thread with a small bounded queue. Button presses
+only add a command to the queue, so a double click can never have two threads driving the
+same motor at once and commands always run in the order they were given.
+"""
+
+from collections import deque
+from typing import Final
+import threading
+import time
+
+import Metrics
+
+QUEUE_DEPTH: Final[int] = 8     # pending commands per actuator before new ones are refused
+
+
+class Command:
+    """A single queued call on an actuator"""
+
+    def __init__(self, func, args: tuple, merge_key: str=None, description: str='', on_dropped=None):
+        self.func = func
+        self.args = args
+        self.merge_key = merge_key
+        self.description = description
+        self.on_dropped = on_dropped    # called if the command is cleared or merged away before it runs
+        self.enqueued = time.perf_counter()
+
+
+class ActuatorWorker:
+    """
+    Runs the commands for one actuator in order on a single thread.
+
+    Commands submitted with a merge_key replace a pending command with the same key, so a
+    newer position target supersedes one that has not started yet. Wait and run time of
+    the last command are kept for the GUI, as are any errors raised by a command. Every
+    wait also goes into the queue_wait histogram in Metrics, under the worker's name.
+    """
+
+    def __init__(self, name: str, max_depth: int=QUEUE_DEPTH):
+        self.name = name
+        self.max_depth = max_depth
+        self.pending = deque()
+        self.errors = deque(maxlen=max_depth)
+        self.busy = False
+        self.last_wait = None           # seconds between submit and start of the last command
+        self.last_run_time = None       # seconds the last command took
+        self.last_description = ''
+        self.metrics = Metrics.actuator(name)
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._work, name=f"worker-{name}", daemon=True)
+        self._thread.start()
+
+    @property
+    def depth(self) -> int:
+        return len(self.pending)
+
+    def submit(self, func, *args, merge_key: str=None, description: str='', on_dropped=None) -> bool:
+        """
+        Queue func(*args). Returns False if the queue is full and the command was refused.
+        on_dropped() is called instead of func if the command is dropped before it starts.
+        """
+        command = Command(func, args, merge_key, description, on_dropped)
+        dropped = []
+        with self._cond:
+            if merge_key is not None:
+                for old in list(self.pending):
+                    if old.merge_key == merge_key:
+                        self.pending.remove(old)
+                        dropped.append(old)
+            if len(self.pending) >= self.max_depth:
+                accepted = False
+            else:
+                self.pending.append(command)
+                self._cond.notify()
+                accepted = True
+        self._dropped(dropped)
+        return accepted
+
+    def clear(self) -> int:
+        """Drop every pending command, returns how many were dropped"""
+        with self._cond:
+            dropped = list(self.pending)
+            self.pending.clear()
+        self._dropped(dropped)
+        return len(dropped)
+
+    def stop(self):
+        """Let the worker finish its current command and exit"""
+        with self._cond:
+            self._running = False
+            dropped = list(self.pending)
+            self.pending.clear()
+            self._cond.notify()
+        self._dropped(dropped)
+
+    @staticmethod
+    def _dropped(commands: list):
+        """Tell whoever queued them, outside the lock so the callbacks can submit again"""
+        for command in commands:
+            if command.on_dropped is not None:
+                command.on_dropped()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while self._running and not self.pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                command = self.pending.popleft()
+                self.busy = True
+            start = time.perf_counter()
+            self.last_wait = start - command.enqueued
+            self.metrics.queue_wait.observe(self.last_wait)
+            self.last_description = command.description
+            try:
+                command.func(*command.args)
+            except Exception as e:
+                self.errors.append(f"{self.name}: {command.description or command.func.__name__} failed: {e}")
+            finally:
+                self.last_run_time = time.perf_counter() - start
+                self.busy = False
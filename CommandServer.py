@@ -0,0 +1,403 @@
+"""
+This script lets the actuators be driven over a socket, for test scripts and the ground
+station that cannot click through the GUI.
+
+The server runs on asyncio in front of the MotorClass actuators. Every message is a 4 byte
+big endian length followed by a JSON object. Requests carry an 'id' that the client picks.
+Every reply and event about a request carries the same id, so any number of requests can be
+in flight on one connection:
+
+    {"id": 1, "op": "call", "actuator": "left_stepper", "method": "move_motor", "args": [200]}
+        -> {"id": 1, "event": "started"} once the actuator's worker picks it up
+        -> {"id": 1, "event": "done", "result": 200, "elapsed": 0.41}
+           or {"id": 1, "event": "error", "error": "..."}
+           or {"id": 1, "event": "cancelled"} if an emergency stop dropped it before it started
+    {"id": 2, "op": "subscribe", "actuators": ["left_stepper"], "interval": 0.05}
+        -> {"id": 2, "event": "state", "actuator": "left_stepper", "state": {...}} whenever it changes
+    {"id": 3, "op": "unsubscribe", "subscription": 2}
+    {"id": 4, "op": "state"}, {"op": "list"}, {"op": "estop"}, {"op": "reset"}, {"op": "ping"}
+        -> {"id": 4, "event": "reply", "result": ...}
+
+Calls on one actuator run in order on its ActuatorWorker, calls on different actuators overlap.
+stop_motor skips the queue, like the GUI's stop buttons. Only the methods in CALLS can be
+called. The server listens on localhost unless told otherwise, there is no authentication.
+
+    python CommandServer.py serve Examples/node_beam_cycle.json --port 8765
+    python CommandServer.py ping --port 8765
+"""
+
+from typing import Final
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import struct
+import time
+
+from CommandQueue import ActuatorWorker
+
+PORT: Final[int] = 8765
+HEADER = struct.Struct('>I')            # length of the JSON body that follows
+MAX_MESSAGE: Final[int] = 1 << 20       # bytes, anything longer closes the connection
+SERVER_QUEUE_DEPTH: Final[int] = 256    # pending calls per actuator, a remote client pipelines more than a person clicks
+STATE_INTERVAL: Final[float] = 0.05     # default seconds between state checks of a subscription
+
+# methods a client may call, and the ones that skip the actuator's queue
+CALLS: Final[frozenset] = frozenset({'move_motor', 'change_pos', 'open', 'close', 'open_close',
+                                     'start_motor', 'stop_motor', 'set_profile', 'clear_profile'})
+IMMEDIATE_CALLS: Final[frozenset] = frozenset({'stop_motor'})
+
+log = logging.getLogger('cosmic.server')
+
+
+class ProtocolError(Exception):
+    """A message that could not be read or does not make sense"""
+
+
+class CallCancelled(Exception):
+    """Raised by CommandClient for a call the server dropped before it started"""
+
+
+def encode(message: dict) -> bytes:
+    body = json.dumps(message, separators=(',', ':'), default=str).encode()
+    return HEADER.pack(len(body)) + body
+
+
+async def read_message(reader: asyncio.StreamReader) -> dict:
+    """The next message, None once the other side has closed the connection"""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    size, = HEADER.unpack(header)
+    if size > MAX_MESSAGE:
+        raise ProtocolError(f"message of {size} bytes is too long")
+    try:
+        body = await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        raise ProtocolError("connection closed in the middle of a message")
+    try:
+        message = json.loads(body)
+    except ValueError as e:
+        raise ProtocolError(f"message is not JSON: {e}")
+    if not isinstance(message, dict):
+        raise ProtocolError("message is not a JSON object")
+    return message
+
+
+class _Connection:
+    """One client. Everything is written from the event loop thread, workers go through send_threadsafe"""
+
+    def __init__(self, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop):
+        self.writer = writer
+        self.loop = loop
+        self.subscriptions = {}     # id -> task
+
+    def send(self, message: dict):
+        if not self.writer.is_closing():
+            self.writer.write(encode(message))
+
+    def send_threadsafe(self, message: dict):
+        self.loop.call_soon_threadsafe(self.send, message)
+
+
+class CommandServer:
+    """Serves {name: actuator} over TCP or a Unix socket, see the module docstring"""
+
+    def __init__(self, actuators: dict, queue_depth: int=SERVER_QUEUE_DEPTH):
+        self.actuators = actuators
+        self.workers = {name: ActuatorWorker(name, queue_depth) for name in actuators}
+        self.server = None
+
+    async def start(self, host: str='127.0.0.1', port: int=PORT, path: str=None):
+        """Listen on host:port, or on the Unix socket 'path' if given"""
+        if path:
+            self.server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        log.info("Command server listening on %s", path or f"{host}:{port}")
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        for worker in self.workers.values():
+            worker.stop()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = _Connection(writer, asyncio.get_running_loop())
+        peer = writer.get_extra_info('peername') or 'unix socket'
+        log.info("Client connected: %s", peer)
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                try:
+                    await self.dispatch(connection, message)
+                except ProtocolError as e:
+                    connection.send({'id': message.get('id'), 'event': 'error', 'error': str(e)})
+                except (ValueError, TypeError, KeyError, AttributeError) as e:
+                    # a field of the wrong type or value, the connection itself is still fine
+                    connection.send({'id': message.get('id'), 'event': 'error',
+                                     'error': f"bad request: {type(e).__name__}: {e}"})
+                await writer.drain()    # stop reading while the client is not reading its replies
+        except (ProtocolError, ConnectionError) as e:
+            log.warning("Dropping client %s: %s", peer, e)
+        finally:
+            for task in connection.subscriptions.values():
+                task.cancel()
+            writer.close()
+            log.info("Client disconnected: %s", peer)
+
+    async def dispatch(self, connection: _Connection, message: dict):
+        request_id = message.get('id')
+        op = message.get('op')
+        if op == 'call':
+            self.call(connection, request_id, message)
+            return
+        if op == 'ping':
+            result = time.time()
+        elif op == 'list':
+            result = {name: getattr(a, '_cls', type(a)).__name__ for name, a in self.actuators.items()}
+        elif op == 'state':
+            result = {name: self.state(name) for name in self._names(message)}
+        elif op == 'subscribe':
+            names = self._names(message)
+            interval = float(message.get('interval') or STATE_INTERVAL)
+            if interval <= 0:
+                raise ProtocolError("'interval' has to be positive")
+            connection.subscriptions[request_id] = asyncio.create_task(
+                self.stream_state(connection, request_id, names, interval))
+            result = names
+        elif op == 'unsubscribe':
+            task = connection.subscriptions.pop(message.get('subscription'), None)
+            if task is not None:
+                task.cancel()
+            result = task is not None
+        elif op == 'estop':
+            import MotorClass   # not at the top, clients import this module without any GPIO backend
+            for worker in self.workers.values():
+                worker.clear()      # nothing queued before the stop runs after it
+            result = await asyncio.to_thread(MotorClass.emergency_stop)
+            log.warning("Emergency stop from a remote client")
+        elif op == 'reset':
+            import MotorClass
+            MotorClass.reset_emergency_stop()
+            result = True
+        else:
+            raise ProtocolError(f"unknown op '{op}'")
+        connection.send({'id': request_id, 'event': 'reply', 'result': result})
+
+    def _names(self, message: dict) -> list:
+        names = message.get('actuators') or list(self.actuators)
+        unknown = [name for name in names if name not in self.actuators]
+        if unknown:
+            raise ProtocolError(f"unknown actuators: {unknown}")
+        return names
+
+    def state(self, name: str) -> dict:
+        return self.actuators[name].state._asdict()
+
+    def call(self, connection: _Connection, request_id, message: dict):
+        """Queue a call on its actuator's worker, the events are sent from the worker thread"""
+        name = message.get('actuator')
+        method = message.get('method')
+        if name not in self.actuators:
+            raise ProtocolError(f"unknown actuator '{name}'")
+        if method not in CALLS:
+            raise ProtocolError(f"'{method}' cannot be called remotely")
+        args = message.get('args', [])
+        kwargs = message.get('kwargs', {})
+        if not isinstance(args, list) or not isinstance(kwargs, dict):
+            raise ProtocolError("'args' has to be a list and 'kwargs' an object")
+        actuator = self.actuators[name]
+
+        def run():
+            connection.send_threadsafe({'id': request_id, 'event': 'started'})
+            start = time.perf_counter()
+            try:
+                result = getattr(actuator, method)(*args, **kwargs)
+            except Exception as e:
+                connection.send_threadsafe({'id': request_id, 'event': 'error', 'error': f"{type(e).__name__}: {e}"})
+                return
+            connection.send_threadsafe({'id': request_id, 'event': 'done', 'result': result,
+                                        'elapsed': time.perf_counter() - start})
+
+        if method in IMMEDIATE_CALLS:
+            asyncio.get_running_loop().run_in_executor(None, run)
+        elif not self.workers[name].submit(run, description=f"{method}{tuple(args)}",
+                                           on_dropped=lambda: connection.send_threadsafe(
+                                               {'id': request_id, 'event': 'cancelled'})):
+            raise ProtocolError(f"{name} already has {self.workers[name].depth} calls queued")
+
+    async def stream_state(self, connection: _Connection, request_id, names: list, interval: float):
+        """Send the state of every actuator in 'names' whenever its snapshot has been replaced"""
+        seen = {}
+        while True:
+            for name in names:
+                state = self.actuators[name].state
+                if seen.get(name) is not state:
+                    seen[name] = state
+                    connection.send({'id': request_id, 'event': 'state', 'actuator': name, 'state': state._asdict()})
+            await asyncio.sleep(interval)
+
+
+class CommandClient:
+    """
+    asyncio client for CommandServer. Requests are pipelined: call() sends straight away and
+    its result is awaited separately, so many calls can be in flight at once.
+
+        client = await CommandClient.connect(port=8765)
+        moves = [client.call('left_stepper', 'move_motor', 200), client.call('right_tray', 'move_motor', 50, 2)]
+        print(await asyncio.gather(*moves))
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count(1)
+        self.pending = {}           # id -> future of the final reply
+        self.on_started = {}        # id -> callback for calls that asked for it
+        self.subscriptions = {}     # id -> callback(actuator, state)
+        self._reader_task = asyncio.create_task(self._read())
+
+    @classmethod
+    async def connect(cls, host: str='127.0.0.1', port: int=PORT, path: str=None) -> 'CommandClient':
+        if path:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def _read(self):
+        try:
+            while True:
+                message = await read_message(self.reader)
+                if message is None:
+                    break
+                request_id = message.get('id')
+                event = message.get('event')
+                if event == 'state':
+                    callback = self.subscriptions.get(request_id)
+                    if callback is not None:
+                        callback(message['actuator'], message['state'])
+                elif event == 'started':
+                    callback = self.on_started.pop(request_id, None)
+                    if callback is not None:
+                        callback()
+                else:
+                    future = self.pending.pop(request_id, None)
+                    self.on_started.pop(request_id, None)
+                    if future is None or future.done():
+                        continue
+                    if event == 'error':
+                        future.set_exception(RuntimeError(message['error']))
+                    elif event == 'cancelled':
+                        future.set_exception(CallCancelled(f"request {request_id} was dropped by an emergency stop"))
+                    else:
+                        future.set_result(message.get('result'))
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("connection to the command server closed"))
+            self.pending.clear()
+
+    def _send(self, op: str, **fields) -> tuple:
+        """Send a request, returns (its id, the future of its reply)"""
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(encode({'id': request_id, 'op': op, **fields}))
+        return request_id, future
+
+    def request(self, op: str, **fields) -> asyncio.Future:
+        """Send a request and return the future of its reply without waiting for it"""
+        return self._send(op, **fields)[1]
+
+    def call(self, actuator: str, method: str, *args, on_started=None, **kwargs) -> asyncio.Future:
+        """
+        Queue actuator.method(*args, **kwargs) on the server, the future resolves with its
+        return value when it has finished. on_started() is called when the actuator picks it up.
+        """
+        request_id, future = self._send('call', actuator=actuator, method=method, args=args, kwargs=kwargs)
+        if on_started is not None:
+            self.on_started[request_id] = on_started
+        return future
+
+    async def subscribe(self, callback, actuators: list=None, interval: float=STATE_INTERVAL) -> int:
+        """Call callback(actuator, state dict) whenever a state changes, returns the subscription id"""
+        request_id, future = self._send('subscribe', actuators=actuators, interval=interval)
+        self.subscriptions[request_id] = callback
+        await future
+        return request_id
+
+    async def unsubscribe(self, subscription: int):
+        self.subscriptions.pop(subscription, None)
+        await self.request('unsubscribe', subscription=subscription)
+
+    async def state(self, actuators: list=None) -> dict:
+        return await self.request('state', actuators=actuators)
+
+    async def emergency_stop(self) -> dict:
+        return await self.request('estop')
+
+    async def reset_emergency_stop(self):
+        return await self.request('reset')
+
+    async def ping(self) -> float:
+        """Round trip time in seconds"""
+        start = time.perf_counter()
+        await self.request('ping')
+        return time.perf_counter() - start
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self._reader_task.cancel()
+
+
+async def _serve(args):
+    from Sequence import Sequence
+
+    sequence = Sequence.load(args.actuators)
+    actuators = sequence.build_actuators()
+    server = CommandServer(actuators)
+    try:
+        await server.start(args.host, args.port, args.unix)
+        await server.server.serve_forever()
+    finally:
+        server.close()
+        for actuator in actuators.values():
+            actuator.clean()
+
+
+async def _ping(args):
+    client = await CommandClient.connect(args.host, args.port, args.unix)
+    times = sorted([await client.ping() for _ in range(args.count)])
+    print(f"{args.count} round trips: median {times[len(times) // 2] * 1e6:.0f} us, "
+          f"p99 {times[int(0.99 * len(times))] * 1e6:.0f} us")
+    start = time.perf_counter()
+    await asyncio.gather(*[client.request('ping') for _ in range(args.count)])
+    elapsed = time.perf_counter() - start
+    print(f"{args.count} pipelined: {elapsed * 1e3:.1f} ms, {args.count / elapsed:.0f} requests/s")
+    await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the actuators over a socket, or ping a server")
+    parser.add_argument('command', choices=['serve', 'ping'])
+    parser.add_argument('actuators', nargs='?', default='Examples/node_beam_cycle.json',
+                        help="sequence file whose 'actuators' are served")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--unix', help="Unix socket path instead of TCP")
+    parser.add_argument('--count', type=int, default=1000, help="pings to send")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    asyncio.run(_serve(args) if args.command == 'serve' else _ping(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+This script predicts how long an assembly sequence takes without running it on the rig.
+
+Every operation gets a duration from the timing model of its actuator (Stepper.move_time,
+ServoMotor.move_time, DCMotor.move_time), which use the same planning code as the real moves.
+The sequence is then scheduled the same way Sequence.run executes it (operations start in
+definition order as soon as their dependencies are done and their locks are free) to get
+the makespan and the critical path, the chain of operations that sets the cycle time.
+
+It then tries a few changes and reports the ones that shorten the cycle:
+    reorder     - put the operations with the longest remaining path first
+    overlap     - drop one dependency on the critical path
+    unlock      - drop one shared lock on the critical path
+Dropping a dependency or lock is only a suggestion, check that the motion is actually safe.
+
+    python CycleTime.py Examples/node_beam_cycle.json
+    python CycleTime.py Examples/node_beam_cycle.json --write faster.json
+"""
+
+from typing import Final
+import argparse
+import copy
+import json
+
+import GPIOBackend
+from Sequence import Sequence, SequenceError
+
+EPSILON: Final[float] = 1e-9     # seconds, end/start times closer than this count as touching
+
+# which timing model method estimates which call, calls missing here take no time
+TIMING_MODELS: Final[dict] = {
+    'move_motor': 'move_time',
+    'change_pos': 'move_time',
+}
+
+
+def durations(sequence: Sequence, actuators: dict) -> dict:
+    """Estimated seconds per operation. Servo moves start where the previous one on that servo ended"""
+    positions = {name: getattr(actuator, 'position', None) for name, actuator in actuators.items()}
+    result = {}
+    for op in sequence.order():
+        model = TIMING_MODELS.get(op.call)
+        actuator = actuators[op.actuator]
+        if model is None or not hasattr(actuator, model):
+            result[op.name] = 0.0
+            continue
+        if op.call == 'change_pos':
+            result[op.name] = getattr(actuator, model)(*op.args, start=positions[op.actuator])
+            positions[op.actuator] = op.args[0]
+        else:
+            result[op.name] = getattr(actuator, model)(*op.args)
+    return result
+
+
+def schedule(sequence: Sequence, times: dict, priority: list=None) -> dict:
+    """
+    {operation name: (start, end)} when run like Sequence.run. 'priority' is the order ready
+    operations are started in, definition order by default.
+    """
+    ops = [sequence.operations[name] for name in (priority or sequence.operations)]
+    pending = list(ops)
+    running = {}    # name -> end time
+    held = set()
+    done = set()
+    result = {}
+    now = 0.0
+    while pending or running:
+        for op in list(pending):
+            if all(dep in done for dep in op.after) and not op.locks & held:
+                held |= op.locks
+                result[op.name] = (now, now + times[op.name])
+                running[op.name] = now + times[op.name]
+                pending.remove(op)
+        if not running:
+            raise SequenceError(f"operations can never start: {[op.name for op in pending]}")
+        now = min(running.values())
+        for name in [name for name, end in running.items() if end <= now + EPSILON]:
+            del running[name]
+            held -= sequence.operations[name].locks
+            done.add(name)
+    return result
+
+
+def makespan(schedule_times: dict) -> float:
+    return max((end for start, end in schedule_times.values()), default=0.0)
+
+
+def critical_path(sequence: Sequence, schedule_times: dict) -> list:
+    """
+    Walk back from the operation that finishes last, each time to the operation that
+    released it: a dependency, or the last holder of one of its locks.
+    """
+    if not schedule_times:
+        return []
+    name = max(schedule_times, key=lambda n: schedule_times[n][1])
+    path = [name]
+    while schedule_times[name][0] > EPSILON:
+        op = sequence.operations[name]
+        start = schedule_times[name][0]
+        blockers = [dep for dep in op.after if abs(schedule_times[dep][1] - start) <= EPSILON]
+        if not blockers:
+            blockers = [other.name for other in sequence.operations.values()
+                        if other.name != name and other.locks & op.locks
+                        and abs(schedule_times[other.name][1] - start) <= EPSILON]
+        if not blockers:
+            break
+        name = blockers[0]
+        path.append(name)
+    path.reverse()
+    return path
+
+
+def longest_first(sequence: Sequence, times: dict) -> list:
+    """Operation names ordered by the longest chain of dependents still to come after them"""
+    tail = {}
+    for op in reversed(sequence.order()):
+        followers = [other for other in sequence.operations.values() if op.name in other.after]
+        tail[op.name] = times[op.name] + max((tail[f.name] for f in followers), default=0.0)
+    names = list(sequence.operations)
+    return sorted(names, key=lambda n: (-tail[n], names.index(n)))
+
+
+def suggest(sequence: Sequence, times: dict, limit: int=5) -> list:
+    """[(seconds saved, description, changed sequence)] best first"""
+    base_times = schedule(sequence, times)
+    base = makespan(base_times)
+    path = critical_path(sequence, base_times)
+    suggestions = []
+
+    order = longest_first(sequence, times)
+    if order != list(sequence.operations):
+        reordered = copy.deepcopy(sequence)
+        reordered.operations = {name: reordered.operations[name] for name in order}
+        saved = base - makespan(schedule(reordered, times))
+        if saved > EPSILON:
+            suggestions.append((saved, "reorder the operations, longest remaining path first", reordered))
+
+    on_path = set(path)
+    for name in path:
+        op = sequence.operations[name]
+        for dep in op.after:
+            if dep in on_path:
+                changed = copy.deepcopy(sequence)
+                changed.operations[name].after.remove(dep)
+                saved = base - makespan(schedule(changed, times))
+                if saved > EPSILON:
+                    suggestions.append((saved, f"overlap '{name}' with '{dep}' (drop the dependency)", changed))
+        for lock in op.locks - {op.actuator}:
+            changed = copy.deepcopy(sequence)
+            changed.operations[name].locks.discard(lock)
+            saved = base - makespan(schedule(changed, times))
+            if saved > EPSILON:
+                suggestions.append((saved, f"let '{name}' run without lock '{lock}'", changed))
+
+    suggestions.sort(key=lambda s: -s[0])
+    return suggestions[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate the cycle time of an assembly sequence")
+    parser.add_argument('sequence', help="JSON or YAML sequence file that lists its actuators")
+    parser.add_argument('--suggestions', type=int, default=5, help="how many improvements to show")
+    parser.add_argument('--write', help="write the sequence with the best suggestion applied to this file")
+    args = parser.parse_args()
+
+    GPIOBackend.select('virtual')   # the actuators are only built for their timing models
+    sequence = Sequence.load(args.sequence)
+    actuators = sequence.build_actuators()
+    sequence.validate(actuators)
+    times = durations(sequence, actuators)
+    planned = schedule(sequence, times)
+    total = makespan(planned)
+
+    print(f"{sequence.name}: {total:.2f} s per cycle, {sum(times.values()):.2f} s one at a time\n")
+    print(f"{'operation':<24} {'start':>8} {'end':>8} {'time':>8}")
+    for name, (start, end) in sorted(planned.items(), key=lambda item: item[1]):
+        print(f"{name:<24} {start:8.2f} {end:8.2f} {times[name]:8.2f}")
+    print(f"\nCritical path: {' -> '.join(critical_path(sequence, planned))}")
+
+    suggestions = suggest(sequence, times, args.suggestions)
+    if not suggestions:
+        print("\nNo single change found that shortens the critical path")
+        return
+    print("\nSuggestions:")
+    for saved, description, changed in suggestions:
+        print(f"  -{saved:.2f} s  {description}")
+    if args.write:
+        with open(args.write, 'w') as f:
+            json.dump(suggestions[0][2].to_dict(), f, indent=2)
+            f.write('\n')
+        print(f"\nWrote '{suggestions[0][1]}' to {args.write}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+"""
+This script is a flight recorder for the GPIO pins, so a move that went wrong on the rig can be
+looked at afterwards instead of guessed at.
+
+With COSMIC_FLIGHT_RECORDER=<file> set, MotorClass wraps its GPIO backend in RecordingGPIO.
+Every setup, output, PWM start/stop, duty and frequency change is then appended as a 16 byte
+record to a preallocated, memory mapped ring file. The oldest records are overwritten once
+it is full. Writing a record is one struct.pack_into into the map, cheap enough to leave on
+during 10 kHz stepping, and the data is still in the file if the program crashes.
+
+The file is only opened by the process that sets up the pins (with COSMIC_MOTION_PROCESS that
+is the motion process, not the GUI). The recording of the previous run is never overwritten,
+it is moved to <file>.1, the one before that to <file>.2 and so on, KEEP_RUNS runs in total.
+
+The analyzer rebuilds every pin's waveform from the file and reports step interval jitter,
+late or missed steps, repeated writes that were not edges and the timing of duty updates:
+
+    python FlightRecorder.py analyze /tmp/cosmic.rec
+    python FlightRecorder.py dump /tmp/cosmic.rec > events.csv
+"""
+
+from typing import Final
+import argparse
+import csv
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+RECORDER_ENV: Final[str] = 'COSMIC_FLIGHT_RECORDER'
+RECORDS: Final[int] = 1 << 20          # records in the ring, 16 MiB of file
+KEEP_RUNS: Final[int] = 5               # recordings kept, the current one included
+
+MAGIC: Final[bytes] = b'COSMREC1'
+HEADER = struct.Struct('<8sIIQ')       # magic, capacity, record size, records written so far
+HEADER_SIZE: Final[int] = 64
+COUNT_OFFSET: Final[int] = 16
+RECORD = struct.Struct('<QHBxf')       # time ns, pin, kind, value
+
+# record kinds
+SETUP: Final[int] = 1       # value: direction
+OUTPUT: Final[int] = 2      # value: level
+PWM_START: Final[int] = 3   # value: duty
+DUTY: Final[int] = 4        # value: duty
+FREQUENCY: Final[int] = 5   # value: frequency
+PWM_STOP: Final[int] = 6
+CLEANUP: Final[int] = 7     # pin 0xffff for a full cleanup
+TRAIN: Final[int] = 8       # value: steps a hardware pulse train played, recorded as it ends
+KIND_NAMES: Final[dict] = {SETUP: 'setup', OUTPUT: 'output', PWM_START: 'pwm_start', DUTY: 'duty',
+                           FREQUENCY: 'frequency', PWM_STOP: 'pwm_stop', CLEANUP: 'cleanup', TRAIN: 'train'}
+ALL_PINS: Final[int] = 0xffff
+
+# analyzer settings
+BURST_GAP: Final[float] = 10.0      # an interval this many times the median starts a new move...
+MIN_MOVE_GAP_NS: Final[int] = 20_000_000    # ...if it is also at least this long, one scheduling hiccup is not a new move
+LATE_FACTOR: Final[float] = 1.5     # an interval this many times the median counts as a late/missed step
+
+
+class FlightRecorder:
+    """Ring of fixed size event records in a memory mapped file"""
+
+    def __init__(self, path: str, capacity: int=RECORDS, clock=time):
+        size = HEADER_SIZE + capacity * RECORD.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self.map, 0, MAGIC, capacity, RECORD.size, 0)
+        self.path = path
+        self.capacity = capacity
+        self.count = 0
+        self.now = clock.perf_counter_ns
+        self._lock = threading.Lock()
+
+    def record(self, pin: int, kind: int, value: float=0.0):
+        t = self.now()
+        with self._lock:
+            RECORD.pack_into(self.map, HEADER_SIZE + (self.count % self.capacity) * RECORD.size, t, pin, kind, value)
+            self.count += 1
+            struct.pack_into('<Q', self.map, COUNT_OFFSET, self.count)
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+
+
+def rotate(path: str, keep: int=KEEP_RUNS):
+    """Move path to path.1, path.1 to path.2 and so on, dropping the oldest of 'keep'"""
+    for i in range(keep - 1, 0, -1):
+        older = f"{path}.{i}"
+        if os.path.exists(older):
+            os.replace(older, f"{path}.{i + 1}")
+    if os.path.exists(path):
+        os.replace(path, f"{path}.1")
+
+
+class RecordingPWM:
+    """Wraps a backend PWM object and records everything sent to it"""
+
+    def __init__(self, pwm, pin: int, recorder):
+        self.pwm = pwm
+        self.pin = pin
+        self.recorder = recorder
+
+    def start(self, dc):
+        self.pwm.start(dc)
+        self.recorder.record(self.pin, PWM_START, dc)
+
+    def ChangeDutyCycle(self, dc):
+        self.pwm.ChangeDutyCycle(dc)
+        self.recorder.record(self.pin, DUTY, dc)
+
+    def ChangeFrequency(self, freq):
+        self.pwm.ChangeFrequency(freq)
+        self.recorder.record(self.pin, FREQUENCY, freq)
+
+    def stop(self):
+        self.pwm.stop()
+        self.recorder.record(self.pin, PWM_STOP)
+
+    def __getattr__(self, name):
+        return getattr(self.pwm, name)
+
+
+class RecordingGPIO:
+    """
+    Passes every call on to a GPIO backend and records the ones that change a pin. The
+    recording file is opened (and the previous one rotated) by the first setup(), so a
+    process that never sets up a pin never touches it.
+    """
+
+    def __init__(self, backend, path: str, capacity: int=RECORDS):
+        self.backend = backend
+        self.path = path
+        self.capacity = capacity
+        self.recorder = None
+        self._lock = threading.Lock()
+
+    def open(self) -> FlightRecorder:
+        with self._lock:
+            if self.recorder is None:
+                rotate(self.path)
+                self.recorder = FlightRecorder(self.path, self.capacity, getattr(self.backend, 'clock', time))
+        return self.recorder
+
+    def record(self, pin: int, kind: int, value: float=0.0):
+        if self.recorder is not None:
+            self.recorder.record(pin, kind, value)
+
+    def setup(self, channel, direction, *args, **kwargs):
+        self.backend.setup(channel, direction, *args, **kwargs)
+        recorder = self.open()
+        for pin in channel if isinstance(channel, (list, tuple)) else [channel]:
+            recorder.record(pin, SETUP, direction)
+
+    def output(self, channel, value):
+        self.backend.output(channel, value)
+        if isinstance(channel, (list, tuple)):
+            values = value if isinstance(value, (list, tuple)) else [value] * len(channel)
+            for pin, level in zip(channel, values):
+                self.record(pin, OUTPUT, level)
+        else:
+            self.record(channel, OUTPUT, value)
+
+    def PWM(self, channel, frequency):
+        pwm = RecordingPWM(self.backend.PWM(channel, frequency), channel, self)
+        self.record(channel, FREQUENCY, frequency)
+        return pwm
+
+    def cleanup(self, channel=None):
+        if channel is None:
+            self.backend.cleanup()
+            self.record(ALL_PINS, CLEANUP)
+        else:
+            self.backend.cleanup(channel)
+            for pin in channel if isinstance(channel, (list, tuple)) else [channel]:
+                self.record(pin, CLEANUP)
+
+    def __getattr__(self, name):
+        attr = getattr(self.backend, name)
+        if name == 'pulse_train':
+            def pulse_train(channel, periods, cancel=None):
+                steps = attr(channel, periods, cancel)
+                if steps is not None:   # None if the backend left the steps to the caller
+                    self.record(channel, TRAIN, steps)
+                return steps
+            return pulse_train
+        return attr
+
+
+def from_env(backend):
+    """Wrap backend in a RecordingGPIO if COSMIC_FLIGHT_RECORDER names a file, else return it as is"""
+    path = os.environ.get(RECORDER_ENV)
+    if not path:
+        return backend
+    return RecordingGPIO(backend, path)
+
+
+def read(path: str) -> list:
+    """Every record still in the file as (time ns, pin, kind, value), oldest first"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, capacity, size, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or size != RECORD.size:
+        raise ValueError(f"{path} is not a flight recorder file")
+    kept = min(count, capacity)
+    first = count - kept
+    return [RECORD.unpack_from(data, HEADER_SIZE + ((first + i) % capacity) * RECORD.size) for i in range(kept)]
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def bursts(times: list) -> list:
+    """Split event times into moves wherever the gap is far longer than the median interval"""
+    if len(times) < 3:
+        return [times] if times else []
+    intervals = [b - a for a, b in zip(times, times[1:])]
+    limit = max(BURST_GAP * percentile(intervals, 0.5), MIN_MOVE_GAP_NS)
+    groups = [[times[0]]]
+    for previous, t in zip(times, times[1:]):
+        if t - previous > limit:
+            groups.append([])
+        groups[-1].append(t)
+    return groups
+
+
+def interval_stats(times: list) -> dict:
+    """Jitter of the intervals of one move against their median, in microseconds"""
+    intervals = [b - a for a, b in zip(times, times[1:])]
+    nominal = percentile(intervals, 0.5)
+    errors = [abs(i - nominal) / 1e3 for i in intervals]
+    return {
+        'events': len(times),
+        'nominal_us': nominal / 1e3,
+        'jitter_p50_us': percentile(errors, 0.5),
+        'jitter_p99_us': percentile(errors, 0.99),
+        'jitter_max_us': max(errors),
+        'late': sum(1 for i in intervals if i > LATE_FACTOR * nominal),
+    }
+
+
+def analyze(records: list) -> dict:
+    """Per pin summary: edges, repeated writes, step jitter per move and duty update timing"""
+    pins = {}
+    for t, pin, kind, value in records:
+        pins.setdefault(pin, []).append((t, kind, value))
+
+    report = {}
+    for pin, events in sorted(pins.items()):
+        if pin == ALL_PINS:
+            continue
+        level = None
+        rising = []
+        repeated = 0
+        duties = []
+        for t, kind, value in events:
+            if kind == OUTPUT:
+                value = int(value)
+                if value == level:
+                    repeated += 1   # written again without changing, not an edge
+                elif value:
+                    rising.append(t)
+                level = value
+            elif kind == DUTY:
+                duties.append(t)
+            elif kind in (SETUP, CLEANUP):
+                level = None
+        entry = {'events': len(events), 'rising_edges': len(rising), 'repeated_writes': repeated}
+        moves = [interval_stats(b) for b in bursts(rising) if len(b) > 2]
+        if moves:
+            entry['moves'] = moves
+            entry['late_steps'] = sum(m['late'] for m in moves)
+        updates = [interval_stats(b) for b in bursts(duties) if len(b) > 2]
+        if updates:
+            entry['duty_updates'] = updates
+        report[pin] = entry
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read a GPIO flight recorder file")
+    parser.add_argument('command', choices=['analyze', 'dump'])
+    parser.add_argument('file')
+    parser.add_argument('--pin', type=int, help="only this pin")
+    args = parser.parse_args()
+
+    records = read(args.file)
+    if args.pin is not None:
+        records = [r for r in records if r[1] == args.pin]
+    if args.command == 'dump':
+        writer = csv.writer(sys.stdout)
+        writer.writerow(['time_ns', 'pin', 'kind', 'value'])
+        for t, pin, kind, value in records:
+            writer.writerow([t, pin, KIND_NAMES.get(kind, kind), value])
+        return
+
+    if not records:
+        print("No records")
+        return
+    span = (records[-1][0] - records[0][0]) / 1e9
+    print(f"{len(records)} records over {span:.3f} s")
+    for pin, entry in analyze(records).items():
+        print(f"\nPin {pin}: {entry['events']} events, {entry['rising_edges']} rising edges, "
+              f"{entry['repeated_writes']} repeated writes")
+        for i, move in enumerate(entry.get('moves', [])):
+            print(f"  move {i + 1}: {move['events']} steps every {move['nominal_us']:.1f} us, jitter "
+                  f"p50 {move['jitter_p50_us']:.1f} p99 {move['jitter_p99_us']:.1f} "
+                  f"max {move['jitter_max_us']:.1f} us, {move['late']} late/missed")
+        for i, update in enumerate(entry.get('duty_updates', [])):
+            print(f"  duty run {i + 1}: {update['events']} updates every {update['nominal_us']:.0f} us, "
+                  f"p99 off by {update['jitter_p99_us']:.1f} us, max {update['jitter_max_us']:.1f} us, "
+                  f"{update['late']} late")
+
+
+if __name__ == '__main__':
+    main()
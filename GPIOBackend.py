@@ -0,0 +1,547 @@
+"""
+This script picks the GPIO library that MotorClass talks to.
+
+Every backend looks like the RPi.GPIO module (setmode, setup, output, PWM, cleanup and the
+BOARD/OUT/HIGH/LOW constants), so the motor classes do not care which one they get. Pins are
+always given in BOARD numbering like everywhere else in the project.
+
+Backends:
+    rpi     - RPi.GPIO, software timed PWM. This is the default
+    pigpio  - the pigpiod daemon, DMA/hardware timed PWM and waveforms
+    sim     - in-process simulator for running the code off the Pi, in real time
+    virtual - the simulator on a virtual clock, sleeping takes no wall clock time at all
+
+Select one with the COSMIC_GPIO_BACKEND environment variable or by calling select() before
+MotorClass is imported. The pigpio backend uses PIGPIO_ADDR and PIGPIO_PORT like the pigpio
+library does.
+"""
+
+from typing import Final
+import os
+import socket
+import struct
+import threading
+import time
+
+BACKEND_ENV: Final[str] = 'COSMIC_GPIO_BACKEND'
+DEFAULT_BACKEND: Final[str] = 'rpi'
+
+# BOARD pin -> BCM GPIO number on the 40 pin header
+BOARD_TO_BCM: Final[dict] = {
+    3: 2, 5: 3, 7: 4, 8: 14, 10: 15, 11: 17, 12: 18, 13: 27, 15: 22, 16: 23, 18: 24, 19: 10,
+    21: 9, 22: 25, 23: 11, 24: 8, 26: 7, 27: 0, 28: 1, 29: 5, 31: 6, 32: 12, 33: 13, 35: 19,
+    36: 16, 37: 26, 38: 20, 40: 21,
+}
+
+SERVO_RANGE_DEG: Final[float] = 180.0  # travel the simulator assumes between min and max pulse
+
+_selected = None
+_backend = None
+
+
+class GPIOBackendError(RuntimeError):
+    """Raised when a backend cannot be loaded or the hardware refuses a command"""
+
+
+def select(name: str):
+    """Choose the backend by name. Must be called before the first load()"""
+    global _selected
+    if _backend is not None and name != _selected:
+        raise GPIOBackendError(f"GPIO backend '{_selected}' is already in use")
+    _selected = name
+
+
+def load():
+    """Return the selected backend, creating it on first use"""
+    global _backend, _selected
+    if _backend is None:
+        name = _selected or os.environ.get(BACKEND_ENV, DEFAULT_BACKEND)
+        if name not in BACKENDS:
+            raise GPIOBackendError(f"Unknown GPIO backend '{name}', expected one of {sorted(BACKENDS)}")
+        _backend = BACKENDS[name]()
+        _selected = name
+    return _backend
+
+
+def backend_name() -> str:
+    return _selected
+
+
+def _load_rpi():
+    try:
+        import RPi.GPIO
+    except ImportError as e:
+        raise GPIOBackendError("RPi.GPIO is not installed, use the 'sim' backend off the Pi") from e
+    return RPi.GPIO
+
+
+class VirtualClock:
+    """
+    Simulated clock with the perf_counter_ns/sleep/monotonic interface of the time module.
+    Sleeping just moves simulated time forward, so motion code runs as fast as the CPU allows.
+    Meant for one sequence at a time, sleeps on parallel threads add up instead of overlapping.
+    """
+    spin_threshold_ns = 0   # sleeping is exact, never busy-wait
+
+    def __init__(self):
+        self.now_ns = 0
+        self.lock = threading.Lock()
+
+    def perf_counter_ns(self) -> int:
+        return self.now_ns
+
+    def monotonic(self) -> float:
+        return self.now_ns / 1e9
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            with self.lock:
+                self.now_ns += int(seconds * 1e9)
+
+
+class SimBackend:
+    """
+    In-process stand-in for RPi.GPIO. It keeps the level of every output pin and the duty
+    cycle of every running PWM so scripts and the GUI can run on any computer.
+
+    Every pin edge and PWM change is recorded in self.events as (time ns, pin, kind, value)
+    with kind 'level', 'duty' or 'freq', timestamped by self.clock. Steppers and servos
+    attached by MotorClass are modelled: stepper_position() counts step edges in the
+    direction of the dir pin and servo_angle() converts the current duty into degrees.
+    """
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+
+    def __init__(self, clock=None, record: bool=True):
+        self.clock = clock or time
+        self.record = record
+        self.mode = None
+        self.levels = {}    # pin -> level for pins set up as outputs
+        self.pwms = {}      # pin -> running PWM
+        self.events = []
+        self.steppers = {}  # step pin -> [dir pin, position]
+        self.servos = {}    # pwm pin -> (min pulse, max pulse) in microseconds
+        self.last_pwm = {}  # pin -> [frequency, duty] of the last PWM signal sent, kept after stop
+
+    def log(self, pin: int, kind: str, value):
+        if self.record:
+            self.events.append((self.clock.perf_counter_ns(), pin, kind, value))
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def getmode(self):
+        return self.mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, channel, direction, pull_up_down=None, initial=None):
+        for pin in self._channels(channel):
+            self.levels[pin] = self.LOW if initial is None else initial
+
+    def output(self, channel, value):
+        pins = self._channels(channel)
+        values = value if isinstance(value, (list, tuple)) else [value] * len(pins)
+        if len(values) != len(pins):
+            raise ValueError("Number of channels != number of values")
+        for pin, level in zip(pins, values):
+            if pin not in self.levels:
+                raise RuntimeError(f"The GPIO channel {pin} has not been set up as an OUTPUT")
+            level = int(bool(level))
+            if level and not self.levels[pin] and pin in self.steppers:
+                model = self.steppers[pin]
+                model[1] += -1 if self.levels.get(model[0]) else 1     # dir HIGH is the negative direction
+            self.levels[pin] = level
+            self.log(pin, 'level', level)
+
+    def input(self, channel):
+        return self.levels.get(channel, self.LOW)
+
+    def cleanup(self, channel=None):
+        pins = list(self.levels) if channel is None else self._channels(channel)
+        for pin in pins:
+            self.levels.pop(pin, None)
+            pwm = self.pwms.pop(pin, None)
+            if pwm is not None:
+                pwm.duty = None
+
+    def PWM(self, channel, frequency):
+        return SimPWM(self, channel, frequency)
+
+    def attach_stepper(self, step_pin: int, dir_pin: int):
+        self.steppers[step_pin] = [dir_pin, 0]
+
+    def attach_servo(self, pwm_pin: int, min_pulse: float, max_pulse: float):
+        self.servos[pwm_pin] = (min_pulse, max_pulse)
+
+    def stepper_position(self, step_pin: int) -> int:
+        return self.steppers[step_pin][1]
+
+    def servo_angle(self, pwm_pin: int) -> float:
+        """Angle in degrees the servo on pwm_pin was last driven to, None if it never was"""
+        frequency, duty = self.last_pwm.get(pwm_pin, (None, None))
+        if duty is None:
+            return None
+        min_pulse, max_pulse = self.servos[pwm_pin]
+        pulse = duty / 100 / frequency * 1e6
+        return (pulse - min_pulse) / (max_pulse - min_pulse) * SERVO_RANGE_DEG
+
+    def history(self, pin: int) -> list:
+        """(time ns, kind, value) of every recorded change on one pin"""
+        return [(t, kind, value) for t, p, kind, value in self.events if p == pin]
+
+    @staticmethod
+    def _channels(channel):
+        return list(channel) if isinstance(channel, (list, tuple)) else [channel]
+
+
+class SimPWM:
+    """PWM object handed out by SimBackend"""
+
+    def __init__(self, backend: SimBackend, channel: int, frequency: float):
+        if channel not in backend.levels:
+            raise RuntimeError(f"The GPIO channel {channel} has not been set up as an OUTPUT")
+        self.backend = backend
+        self.channel = channel
+        self.frequency = frequency
+        self.duty = None    # None while stopped
+        backend.last_pwm[channel] = [frequency, None]
+
+    def start(self, duty):
+        self.duty = duty
+        self.backend.pwms[self.channel] = self
+        self.backend.last_pwm[self.channel][1] = duty
+        self.backend.log(self.channel, 'duty', duty)
+
+    def ChangeDutyCycle(self, duty):
+        if not 0 <= duty <= 100:
+            raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+        self.duty = duty
+        self.backend.last_pwm[self.channel][1] = duty
+        self.backend.log(self.channel, 'duty', duty)
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+        self.backend.last_pwm[self.channel][0] = frequency
+        self.backend.log(self.channel, 'freq', frequency)
+
+    def stop(self):
+        self.duty = None
+        self.backend.pwms.pop(self.channel, None)
+        self.backend.log(self.channel, 'duty', None)
+
+
+class PigpioBackend:
+    """
+    Talks to the pigpiod daemon over its socket interface, so nothing beyond the standard
+    library is needed on our side. PWM is timed by the daemon's DMA engine, or by the PWM
+    hardware on the pins that have it, instead of by Python threads. pulse_train() sends a
+    whole stepper move as a DMA waveform so the CPU is out of step timing altogether.
+    """
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+
+    # pigpiod socket command numbers
+    CMD_MODES = 0
+    CMD_WRITE = 4
+    CMD_PWM = 5
+    CMD_PRS = 6
+    CMD_PFS = 7
+    CMD_BC1 = 12
+    CMD_BS1 = 14
+    CMD_WVAG = 28
+    CMD_WVBSY = 32
+    CMD_WVHLT = 33
+    CMD_WVCRE = 49
+    CMD_WVDEL = 50
+    CMD_WVNEW = 53
+    CMD_HP = 86
+    CMD_WVTXM = 100
+    CMD_WVTAT = 101
+
+    WAVE_MODE_ONE_SHOT_SYNC = 2
+    PWM_RANGE = 10000           # duty range set on every PWM pin, 0.01 % resolution
+    HARDWARE_PWM = {12: 0, 18: 0, 13: 1, 19: 1}     # BCM gpio -> hardware PWM channel
+    WAVE_CHUNK = 2000           # steps per waveform, pigpiod holds ~12000 pulses in total
+    CANCEL_POLL = 0.001         # seconds between cancel checks while a waveform plays
+
+    def __init__(self, host: str=None, port: int=None):
+        host = host or os.environ.get('PIGPIO_ADDR', 'localhost')
+        port = int(port or os.environ.get('PIGPIO_PORT', 8888))
+        try:
+            self.sock = socket.create_connection((host, port))
+        except OSError as e:
+            raise GPIOBackendError(f"Cannot reach pigpiod at {host}:{port}: {e}") from e
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.lock = threading.Lock()
+        self.numbering = self.BOARD
+        self.outputs = set()
+        self.hw_channels = {}   # hardware PWM channel -> BCM gpio using it
+        self.wave_lock = threading.Lock()   # held by the pulse train that owns the wave engine
+        self.wave_gpio = None               # BCM gpio of that train
+
+    def command(self, cmd: int, p1: int=0, p2: int=0, extension: bytes=b'') -> int:
+        """Send one command to pigpiod and return its result, negative results are errors"""
+        message = struct.pack('<IIII', cmd, p1, p2, len(extension)) + extension
+        with self.lock:
+            self.sock.sendall(message)
+            reply = b''
+            while len(reply) < 16:
+                chunk = self.sock.recv(16 - len(reply))
+                if not chunk:
+                    raise GPIOBackendError("pigpiod closed the connection")
+                reply += chunk
+        result = struct.unpack('<12xi', reply)[0]
+        if result < 0:
+            raise GPIOBackendError(f"pigpiod command {cmd} failed with error {result}")
+        return result
+
+    def bcm(self, channel: int) -> int:
+        if self.numbering == self.BCM:
+            return channel
+        try:
+            return BOARD_TO_BCM[channel]
+        except KeyError:
+            raise ValueError(f"Pin {channel} is not a GPIO pin in BOARD numbering") from None
+
+    def setmode(self, mode):
+        self.numbering = mode
+
+    def getmode(self):
+        return self.numbering
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, channel, direction, pull_up_down=None, initial=None):
+        for pin in SimBackend._channels(channel):
+            gpio = self.bcm(pin)
+            self.command(self.CMD_MODES, gpio, 1 if direction == self.OUT else 0)
+            if direction == self.OUT:
+                self.outputs.add(gpio)
+                if initial is not None:
+                    self.command(self.CMD_WRITE, gpio, int(bool(initial)))
+
+    def output(self, channel, value):
+        if not isinstance(channel, (list, tuple)):
+            self.command(self.CMD_WRITE, self.bcm(channel), int(bool(value)))
+            return
+        values = value if isinstance(value, (list, tuple)) else [value] * len(channel)
+        if len(values) != len(channel):
+            raise ValueError("Number of channels != number of values")
+        # a whole batch is at most one set and one clear of the GPIO bank
+        set_mask = clear_mask = 0
+        for pin, level in zip(channel, values):
+            if level:
+                set_mask |= 1 << self.bcm(pin)
+            else:
+                clear_mask |= 1 << self.bcm(pin)
+        if set_mask:
+            self.command(self.CMD_BS1, set_mask)
+        if clear_mask:
+            self.command(self.CMD_BC1, clear_mask)
+
+    def cleanup(self, channel=None):
+        gpios = list(self.outputs) if channel is None else [self.bcm(p) for p in SimBackend._channels(channel)]
+        for gpio in gpios:
+            self.command(self.CMD_PWM, gpio, 0)
+            self.command(self.CMD_MODES, gpio, 0)     # back to input like RPi.GPIO.cleanup
+            self.outputs.discard(gpio)
+            for ch, user in list(self.hw_channels.items()):
+                if user == gpio:
+                    del self.hw_channels[ch]
+
+    def PWM(self, channel, frequency):
+        return PigpioPWM(self, self.bcm(channel), frequency)
+
+    def halt_waves(self, channel: int=None):
+        """
+        Stop the waveform that is playing right now, used by the emergency stop. With a
+        channel only a train on that channel is stopped.
+        """
+        if channel is None or self.wave_gpio == self.bcm(channel):
+            self.command(self.CMD_WVHLT)
+
+    def pulse_train(self, channel: int, periods, cancel: threading.Event=None):
+        """
+        Send len(periods) step pulses on channel as DMA waveforms, periods in seconds between
+        rising edges with the pulse HIGH for half of each. The move is split into chunks that
+        are queued back to back so there is no gap between them. Returns the steps that were
+        played, which is less than requested if 'cancel' was set or the waves were stopped
+        from outside.
+
+        pigpiod builds and plays one waveform at a time for all of its clients, so only one
+        train runs at once. If another one is playing this returns None straight away and
+        the caller has to time the steps itself.
+        """
+        if not self.wave_lock.acquire(blocking=False):
+            return None
+        try:
+            self.wave_gpio = self.bcm(channel)
+            return self._train(1 << self.wave_gpio, periods, cancel)
+        finally:
+            self.wave_gpio = None
+            self.wave_lock.release()
+
+    def _train(self, mask: int, periods, cancel: threading.Event=None) -> int:
+        """pulse_train with the wave engine to ourselves"""
+        def cancelled():
+            return cancel is not None and cancel.is_set()
+
+        def sleep_until(t) -> bool:
+            """Sleep until monotonic time t in short slices, True as soon as cancel is set"""
+            while not cancelled():
+                remaining = t - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(remaining, self.CANCEL_POLL))
+            return True
+
+        def edges(chunk, elapsed: float) -> int:
+            """Rising edges of a chunk that went out in the first 'elapsed' seconds of it"""
+            count = 0
+            for period in chunk:
+                if elapsed < 0:
+                    break
+                count += 1
+                elapsed -= period
+            return count
+
+        def retire(count: int):
+            """Delete the oldest 'count' waves, they have finished playing"""
+            nonlocal played
+            for _ in range(count):
+                wave, chunk, _, _ = queued.pop(0)
+                self.command(self.CMD_WVDEL, wave)
+                played += len(chunk)
+
+        def wait_for(count: int) -> bool:
+            """
+            Wait until at most 'count' of our waves are left to play, checking which one is on
+            air every CANCEL_POLL. False if cancelled or if the waves were stopped from outside.
+            """
+            nonlocal seen
+            while len(queued) > count:
+                on_air = self.command(self.CMD_WVTAT)
+                now = time.monotonic()
+                waves = [entry[0] for entry in queued]
+                if on_air in waves:
+                    retire(waves.index(on_air))
+                    seen = now
+                elif all(edges(chunk, now - begin) == len(chunk) for _, chunk, begin, _ in queued):
+                    retire(len(queued))     # none of ours on air because they have all played
+                else:
+                    return False
+                if len(queued) > count and sleep_until(min(queued[0][3], now + self.CANCEL_POLL)):
+                    return False
+            return True
+
+        queued = []     # [wave id, periods, time its first edge went out, time it finishes]
+        played = 0      # steps of the waves that are known to have finished
+        sent = 0
+        finish = seen = time.monotonic()    # seen: last time one of our waves was found on air
+        try:
+            while sent < len(periods):
+                # keep at most two waves alive, the one playing and the one queued behind it
+                if cancelled() or not wait_for(1):
+                    break
+                chunk = periods[sent:sent + self.WAVE_CHUNK]
+                pulses = bytearray()
+                for period in chunk:
+                    half = max(1, int(period * 5e5))    # microseconds
+                    pulses += struct.pack('<III', mask, 0, half)
+                    pulses += struct.pack('<III', 0, mask, half)
+                self.command(self.CMD_WVNEW)
+                self.command(self.CMD_WVAG, extension=bytes(pulses))
+                wave = self.command(self.CMD_WVCRE)
+                begin = max(finish, time.monotonic())
+                self.command(self.CMD_WVTXM, wave, self.WAVE_MODE_ONE_SHOT_SYNC)
+                finish = begin + sum(chunk)
+                queued.append([wave, chunk, begin, finish])
+                sent += len(chunk)
+
+            if not wait_for(0):
+                # work out from the clock how many steps of the unfinished waves went out, up to
+                # our halt, or if something else (like the emergency stop's halt_waves) stopped
+                # them first, up to the last time they were seen playing, so at most CANCEL_POLL short
+                if self.command(self.CMD_WVTAT) in [entry[0] for entry in queued]:
+                    self.command(self.CMD_WVHLT)
+                    end = time.monotonic()
+                else:
+                    end = seen
+                played += sum(edges(chunk, end - begin) for _, chunk, begin, _ in queued)
+        finally:
+            for wave, _, _, _ in queued:
+                self.command(self.CMD_WVDEL, wave)
+        return played
+
+
+class PigpioPWM:
+    """PWM object handed out by PigpioBackend, uses hardware PWM when the pin has it"""
+
+    def __init__(self, backend: PigpioBackend, gpio: int, frequency: float):
+        self.backend = backend
+        self.gpio = gpio
+        self.frequency = frequency
+        self.duty = None
+        channel = PigpioBackend.HARDWARE_PWM.get(gpio)
+        self.hardware = channel is not None and channel not in backend.hw_channels
+        if self.hardware:
+            backend.hw_channels[channel] = gpio
+
+    def _send(self):
+        if self.hardware:
+            extension = struct.pack('<I', int(self.duty * 1e4))     # duty in millionths
+            self.backend.command(PigpioBackend.CMD_HP, self.gpio, int(self.frequency), extension)
+        else:
+            self.backend.command(PigpioBackend.CMD_PWM, self.gpio, int(round(self.duty * PigpioBackend.PWM_RANGE / 100)))
+
+    def start(self, duty):
+        if not self.hardware:
+            self.backend.command(PigpioBackend.CMD_PFS, self.gpio, int(self.frequency))
+            self.backend.command(PigpioBackend.CMD_PRS, self.gpio, PigpioBackend.PWM_RANGE)
+        self.duty = duty
+        self._send()
+
+    def ChangeDutyCycle(self, duty):
+        if not 0 <= duty <= 100:
+            raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+        self.duty = duty
+        self._send()
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+        if not self.hardware:
+            self.backend.command(PigpioBackend.CMD_PFS, self.gpio, int(frequency))
+        if self.duty is not None:
+            self._send()
+
+    def stop(self):
+        self.duty = None
+        if self.hardware:
+            self.backend.command(PigpioBackend.CMD_HP, self.gpio, 0, struct.pack('<I', 0))
+        else:
+            self.backend.command(PigpioBackend.CMD_PWM, self.gpio, 0)
+
+
+BACKENDS: Final[dict] = {
+    'rpi': _load_rpi,
+    'pigpio': PigpioBackend,
+    'sim': SimBackend,
+    'virtual': lambda: SimBackend(VirtualClock()),
+}
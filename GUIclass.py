@@ -1,10 +1,24 @@
+from time import perf_counter
+_IMPORT_START = perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, messagebox
 from tkinter.scrolledtext import ScrolledText
+import logging
+import os
+import signal
+import sys
 import threading
+import Metrics
 import MotorClass
-from time import strftime
-import RPi.GPIO as GPIO
+import MotionProcess
+import Telemetry
+import update
+from CommandQueue import ActuatorWorker
+from time import strftime, localtime
+from MotorClass import GPIO
+
+IMPORT_TIME = perf_counter() - _IMPORT_START    # seconds spent importing the modules above
 
 # Verified safe GPIO pins (BOARD numbering)
 SAFE_PINS = {
@@ -20,6 +34,28 @@ SAFE_PINS = {
     'sep_mod': (7, 12)
 }
 
+QUEUE_REFRESH_MS = 250  # how often the command queue display is updated
+STATE_REFRESH_MS = 100  # how often the actuator state panel samples the actuators
+LOG_REFRESH_MS = 100    # how often new log messages are moved into the log pane
+LOG_BATCH = 2000        # most messages inserted per refresh, the rest wait for the next one
+LOG_MAX_LINES = 5000    # older lines are removed from the log pane
+METRICS_REFRESH_MS = 1000   # how often the metrics summary is recomputed
+RESTART_POLL_MS = 500       # how often a pending update restart checks whether everything is idle
+
+# MotorClass class driving each actuator
+ACTUATOR_TYPES = {
+    'left_stepper': 'Stepper',
+    'left_flange': 'SmallServo',
+    'left_elevator': 'ServoMotor',
+    'left_tray': 'DCMotor',
+    'right_stepper': 'Stepper',
+    'right_flange': 'SmallServo',
+    'right_elevator': 'ServoMotor',
+    'right_tray': 'DCMotor',
+    'lead_screw': 'DCMotor',
+    'sep_mod': 'DCMotor'
+}
+
 
 class MotorControlGUI:
     def __init__(self, root):
@@ -27,14 +63,30 @@ class MotorControlGUI:
         self.root.title("Torque Arm Control System")
         self.root.geometry("1100x750")
 
+        # Messages from the GUI and the motor code all arrive through the telemetry buffer
+        self.logger = logging.getLogger('cosmic.gui')
+        self.telemetry = Telemetry.TelemetryBuffer()
+        self.telemetry_handler = Telemetry.install(self.telemetry)
+        self.log_dropped = 0
+
         # Initialize UI first (so we can use log)
+        ui_start = perf_counter()
         self.setup_ui()
+        self.drain_log()
+        self.ui_time = perf_counter() - ui_start
 
-        # Then initialize GPIO and motors
-        GPIO.setmode(GPIO.BOARD)
+        # Then initialize GPIO and motors, the hardware is set up in the background
         GPIO.setwarnings(False)
         self.initialize_motors()
 
+        # One worker per actuator, every button press goes through these queues
+        self.workers = {name: ActuatorWorker(name) for name in SAFE_PINS}
+        self.refresh_queues()
+        self.refresh_state()
+        self.refresh_metrics()
+        Metrics.start_from_env()    # Prometheus endpoint or text file, if asked for
+        self.listen_for_updates()
+
     def setup_ui(self):
         """Initialize all UI components first"""
         self.notebook = ttk.Notebook(self.root)
@@ -47,6 +99,17 @@ class MotorControlGUI:
         self.create_left_arm_tab()
         self.create_right_arm_tab()
         self.create_magazine_tab()
+        self.create_state_tab()
+        self.create_metrics_tab()
+
+        # Command queue depth and latency per actuator
+        queue_frame = ttk.LabelFrame(self.root, text="Command Queues", padding=5)
+        queue_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=5)
+        self.queue_vars = {}
+        for i, name in enumerate(SAFE_PINS):
+            self.queue_vars[name] = tk.StringVar(value=f"{name}: idle")
+            ttk.Label(queue_frame, textvariable=self.queue_vars[name], width=45
+                      ).grid(row=i // 2, column=i % 2, sticky=tk.W)
 
         # Status bar
         self.status_var = tk.StringVar(value="System Ready")
@@ -57,13 +120,120 @@ class MotorControlGUI:
         tk.Button(self.root, text="EMERGENCY STOP", bg="red", fg="white",
                   font=('Helvetica', 12, 'bold'), command=self.emergency_stop
                   ).pack(side=tk.BOTTOM, fill=tk.X, padx=5, pady=5)
-
-    def log(self, message):
-        """Add timestamped message to log"""
-        timestamp = strftime("%H:%M:%S")
-        self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.log_text.see(tk.END)
-        self.status_var.set(message)
+        tk.Button(self.root, text="Reset E-Stop", command=self.reset_emergency_stop
+                  ).pack(side=tk.BOTTOM, fill=tk.X, padx=5)
+
+    def log(self, message, level=logging.INFO):
+        """Add a message to the log, it shows up in the log pane on the next refresh"""
+        self.logger.log(level, message)
+
+    def drain_log(self):
+        """Move everything logged since the last refresh into the log pane in one insert"""
+        batch = self.telemetry.drain(LOG_BATCH)
+        if batch:
+            lines = [f"[{strftime('%H:%M:%S', localtime(created))}] {message}\n"
+                     for created, level, source, message in batch]
+            if self.telemetry.dropped != self.log_dropped:
+                lines.append(f"... {self.telemetry.dropped - self.log_dropped} messages dropped\n")
+                self.log_dropped = self.telemetry.dropped
+            self.log_text.insert(tk.END, ''.join(lines))
+            excess = int(self.log_text.index('end-1c').split('.')[0]) - LOG_MAX_LINES
+            if excess > 0:
+                self.log_text.delete('1.0', f'{excess + 1}.0')
+            self.log_text.see(tk.END)
+            self.status_var.set(batch[-1][3])
+        self.root.after(LOG_REFRESH_MS, self.drain_log)
+
+    def set_log_level(self, event=None):
+        """Only messages at the chosen level or above are logged at all"""
+        Telemetry.set_level(self.telemetry_handler, Telemetry.LEVELS[self.log_level_var.get()])
+
+    def submit(self, name, func, *args, merge_key=None, description=''):
+        """Queue a command on an actuator's worker, returns False if its queue is full"""
+        if not self.workers[name].submit(func, *args, merge_key=merge_key, description=description):
+            messagebox.showerror("Error", f"{name} already has {self.workers[name].depth} commands queued")
+            return False
+        return True
+
+    def refresh_queues(self):
+        """Show queue depth and latency of every worker and log any command errors"""
+        for name, worker in self.workers.items():
+            while worker.errors:
+                self.log(worker.errors.popleft(), logging.ERROR)
+            text = f"{name}: {'busy' if worker.busy else 'idle'}, {worker.depth} queued"
+            if worker.last_wait is not None and worker.last_run_time is not None:
+                text += f", last wait {worker.last_wait * 1e3:.0f} ms run {worker.last_run_time:.2f} s"
+            self.queue_vars[name].set(text)
+        self.root.after(QUEUE_REFRESH_MS, self.refresh_queues)
+
+    def refresh_state(self):
+        """
+        Sample every actuator's state snapshot and update the rows that changed. However
+        often the motors publish, the panel only looks at the latest snapshot once per refresh.
+        """
+        for name in SAFE_PINS:
+            motor = getattr(self, name, None)
+            if motor is None:
+                continue
+            state = motor.state
+            worker = self.workers[name]
+            if state.fault:
+                status = state.fault
+            else:
+                status = 'busy' if state.busy or worker.busy else 'idle'
+            latency = f"{worker.last_wait * 1e3:.0f} ms" if worker.last_wait is not None else ''
+            values = (f"{state.position:g}", f"{state.target:g}", f"{state.velocity:.1f}", status, latency)
+            if values != self.state_rows.get(name):
+                self.state_tree.item(name, values=values)
+                self.state_rows[name] = values
+        self.root.after(STATE_REFRESH_MS, self.refresh_state)
+
+    def create_state_tab(self):
+        """Live position, target, velocity and status of every actuator"""
+        tab = ttk.Frame(self.notebook)
+        self.notebook.add(tab, text="Actuator State")
+
+        columns = ('position', 'target', 'velocity', 'status', 'latency')
+        self.state_tree = ttk.Treeview(tab, columns=columns, height=len(SAFE_PINS))
+        self.state_tree.heading('#0', text="Actuator")
+        for column, title in zip(columns, ("Position", "Target", "Velocity (/s)", "Status", "Last Wait")):
+            self.state_tree.heading(column, text=title)
+            self.state_tree.column(column, width=120, anchor=tk.E)
+        for name in SAFE_PINS:
+            self.state_tree.insert('', tk.END, iid=name, text=name)
+        self.state_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.state_rows = {}    # last values shown per actuator, only changed rows are redrawn
+
+    def create_metrics_tab(self):
+        """Command counts and latency percentiles per actuator, from Metrics"""
+        tab = ttk.Frame(self.notebook)
+        self.notebook.add(tab, text="Metrics")
+
+        columns = ('commands', 'errors', 'per_hour', 'wait_p50', 'wait_p95', 'start_p95', 'run_mean', 'overrun_p95')
+        titles = ("Commands", "Errors", "Moves/h", "Wait p50", "Wait p95", "Start p95", "Run Mean", "Overrun p95")
+        self.metrics_tree = ttk.Treeview(tab, columns=columns, height=len(SAFE_PINS))
+        self.metrics_tree.heading('#0', text="Actuator")
+        for column, title in zip(columns, titles):
+            self.metrics_tree.heading(column, text=title)
+            self.metrics_tree.column(column, width=90, anchor=tk.E)
+        for name in SAFE_PINS:
+            self.metrics_tree.insert('', tk.END, iid=name, text=name)
+        self.metrics_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        ttk.Label(tab, text="Percentiles are bucket upper bounds. Set COSMIC_METRICS_PORT or "
+                            "COSMIC_METRICS_FILE to export these for Prometheus.").pack(pady=5)
+
+    def refresh_metrics(self):
+        """Recompute the metrics summary, the histograms are read without stopping the workers"""
+        def ms(seconds):
+            return f"{seconds * 1e3:.1f} ms" if seconds is not None else ''
+
+        for name in SAFE_PINS:
+            m = Metrics.actuator(name)
+            values = (m.commands, m.errors, f"{m.per_hour():.0f}",
+                      ms(m.queue_wait.quantile(0.5)), ms(m.queue_wait.quantile(0.95)),
+                      ms(m.start_latency.quantile(0.95)), ms(m.execution.mean()), ms(m.overrun.quantile(0.95)))
+            self.metrics_tree.item(name, values=values)
+        self.root.after(METRICS_REFRESH_MS, self.refresh_metrics)
 
     def create_log_tab(self):
         """Create the log tab first"""
@@ -73,7 +243,15 @@ class MotorControlGUI:
         self.log_text = ScrolledText(tab, wrap=tk.WORD, width=100, height=30)
         self.log_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
-        tk.Button(tab, text="Clear Log", command=self.clear_log).pack(pady=5)
+        controls = ttk.Frame(tab)
+        controls.pack(pady=5)
+        ttk.Label(controls, text="Level:").pack(side=tk.LEFT)
+        self.log_level_var = tk.StringVar(value='INFO')
+        level_box = ttk.Combobox(controls, textvariable=self.log_level_var, values=list(Telemetry.LEVELS),
+                                 state='readonly', width=10)
+        level_box.pack(side=tk.LEFT, padx=5)
+        level_box.bind('<<ComboboxSelected>>', self.set_log_level)
+        tk.Button(controls, text="Clear Log", command=self.clear_log).pack(side=tk.LEFT, padx=5)
 
     def clear_log(self):
         self.log_text.delete(1.0, tk.END)
@@ -81,28 +259,47 @@ class MotorControlGUI:
 
     def initialize_motors(self):
         """Initialize motor instances with safe pins"""
+        self.motion = None
         try:
-            # Left Arm
-            self.left_stepper = MotorClass.Stepper(*SAFE_PINS['left_stepper'])
-            self.left_flange = MotorClass.SmallServo(SAFE_PINS['left_flange'])
-            self.left_elevator = MotorClass.ServoMotor(SAFE_PINS['left_elevator'])
-            self.left_tray = MotorClass.DCMotor(*SAFE_PINS['left_tray'])
-
-            # Right Arm
-            self.right_stepper = MotorClass.Stepper(*SAFE_PINS['right_stepper'])
-            self.right_flange = MotorClass.SmallServo(SAFE_PINS['right_flange'])
-            self.right_elevator = MotorClass.ServoMotor(SAFE_PINS['right_elevator'])
-            self.right_tray = MotorClass.DCMotor(*SAFE_PINS['right_tray'])
-
-            # Magazine
-            self.lead_screw = MotorClass.DCMotor(*SAFE_PINS['lead_screw'])
-            self.sep_mod = MotorClass.DCMotor(*SAFE_PINS['sep_mod'])
-
-            self.log("All motors initialized successfully")
+            if os.environ.get(MotionProcess.MOTION_PROCESS_ENV):
+                # motion runs in its own process, the attributes below are proxies to it
+                self.motion = MotionProcess.MotionClient(
+                    [(name, ACTUATOR_TYPES[name], pins) for name, pins in SAFE_PINS.items()])
+                for name in SAFE_PINS:
+                    setattr(self, name, self.motion.actuator(name))
+                self.log(f"Motion process started (pid {self.motion.process.pid})")
+                self.log(f"Startup: imports {IMPORT_TIME * 1e3:.0f} ms, UI {self.ui_time * 1e3:.0f} ms")
+            else:
+                # every actuator is usable straight away, the first command builds it if
+                # arming has not got to it yet
+                actuators = {}
+                for name, pins in SAFE_PINS.items():
+                    pins = pins if isinstance(pins, tuple) else (pins,)
+                    actuators[name] = MotorClass.LazyActuator(getattr(MotorClass, ACTUATOR_TYPES[name]), *pins,
+                                                              name=name)
+                    setattr(self, name, actuators[name])
+                threading.Thread(target=self.arm_motors, args=(actuators,), name='arm', daemon=True).start()
         except Exception as e:
-            self.log(f"Motor initialization failed: {str(e)}")
+            self.log(f"Motor initialization failed: {str(e)}", logging.ERROR)
             messagebox.showerror("Initialization Error", f"Failed to initialize motors:\n{str(e)}")
 
+    def arm_motors(self, actuators):
+        """Set up all actuators at once and log the startup time report, runs off the Tk thread"""
+        start = perf_counter()
+        times = MotorClass.arm(actuators)
+        hardware = perf_counter() - start
+        failed = [name for name, t in times.items() if t is None]
+        if failed:
+            self.log(f"Motor initialization failed: {', '.join(failed)}", logging.ERROR)
+        else:
+            self.log("All motors initialized successfully")
+        slowest = max((name for name in times if times[name] is not None), key=times.get, default=None)
+        report = (f"Startup: imports {IMPORT_TIME * 1e3:.0f} ms, UI {self.ui_time * 1e3:.0f} ms, "
+                  f"hardware {hardware * 1e3:.0f} ms")
+        if slowest:
+            report += f" (slowest {slowest} {times[slowest] * 1e3:.0f} ms)"
+        self.log(report + f", ready {(perf_counter() - _IMPORT_START) * 1e3:.0f} ms after start")
+
     def create_left_arm_tab(self):
         """Create controls for left torque arm"""
         tab = ttk.Frame(self.notebook)
@@ -253,8 +450,8 @@ class MotorControlGUI:
         try:
             steps = int(self.right_step_entry.get())
             delay = float(self.right_speed_entry.get())
-            threading.Thread(target=self.right_stepper.move_motor, args=(steps, delay)).start()
-            self.log(f"Right stepper: {steps} steps, {delay}ms delay")
+            if self.submit('right_stepper', self.right_stepper.move_motor, steps, delay):
+                self.log(f"Right stepper: {steps} steps, {delay}ms delay")
         except ValueError:
             messagebox.showerror("Error", "Invalid input values")
 
@@ -262,8 +459,8 @@ class MotorControlGUI:
         try:
             steps = int(self.left_step_entry.get())
             delay = float(self.left_speed_entry.get())
-            threading.Thread(target=self.left_stepper.move_motor, args=(steps, delay)).start()
-            self.log(f"Left stepper: {steps} steps, {delay}ms delay")
+            if self.submit('left_stepper', self.left_stepper.move_motor, steps, delay):
+                self.log(f"Left stepper: {steps} steps, {delay}ms delay")
         except ValueError:
             messagebox.showerror("Error", "Invalid input values")
 
@@ -271,8 +468,8 @@ class MotorControlGUI:
         try:
             pos = int(self.right_flange_pos.get())
             if 0 <= pos <= 100:
-                threading.Thread(target=self.right_flange.change_pos, args=(pos,)).start()
-                self.log(f"Right flange to {pos}%")
+                if self.submit('right_flange', self.right_flange.change_pos, pos, merge_key='position'):
+                    self.log(f"Right flange to {pos}%")
             else:
                 messagebox.showerror("Error", "Must be 0-100")
         except ValueError:
@@ -282,8 +479,8 @@ class MotorControlGUI:
         try:
             pos = int(self.left_flange_pos.get())
             if 0 <= pos <= 100:
-                threading.Thread(target=self.left_flange.change_pos, args=(pos,)).start()
-                self.log(f"Left flange to {pos}%")
+                if self.submit('left_flange', self.left_flange.change_pos, pos, merge_key='position'):
+                    self.log(f"Left flange to {pos}%")
             else:
                 messagebox.showerror("Error", "Must be 0-100")
         except ValueError:
@@ -294,8 +491,8 @@ class MotorControlGUI:
             pos = int(self.right_elevator_pos.get())
             if 0 <= pos <= 100:
                 servo_pos = int((pos / 100) * 180)
-                threading.Thread(target=self.right_elevator.change_pos, args=(servo_pos,)).start()
-                self.log(f"Right elevator to {pos}%")
+                if self.submit('right_elevator', self.right_elevator.change_pos, servo_pos, merge_key='position'):
+                    self.log(f"Right elevator to {pos}%")
             else:
                 messagebox.showerror("Error", "Must be 0-100")
         except ValueError:
@@ -306,8 +503,8 @@ class MotorControlGUI:
             pos = int(self.left_elevator_pos.get())
             if 0 <= pos <= 100:
                 servo_pos = int((pos / 100) * 180)
-                threading.Thread(target=self.left_elevator.change_pos, args=(servo_pos,)).start()
-                self.log(f"Left elevator to {pos}%")
+                if self.submit('left_elevator', self.left_elevator.change_pos, servo_pos, merge_key='position'):
+                    self.log(f"Left elevator to {pos}%")
             else:
                 messagebox.showerror("Error", "Must be 0-100")
         except ValueError:
@@ -317,8 +514,8 @@ class MotorControlGUI:
         try:
             speed = int(self.left_mag_speed.get())
             duration = float(self.left_mag_duration.get())
-            threading.Thread(target=self.left_tray.move_motor, args=(speed, duration)).start()
-            self.log(f"Left magazine running at {speed}% for {duration}s")
+            if self.submit('left_tray', self.left_tray.move_motor, speed, duration):
+                self.log(f"Left magazine running at {speed}% for {duration}s")
         except ValueError:
             messagebox.showerror("Error", "Invalid input values")
 
@@ -326,8 +523,8 @@ class MotorControlGUI:
         try:
             speed = int(self.right_mag_speed.get())
             duration = float(self.right_mag_duration.get())
-            threading.Thread(target=self.right_tray.move_motor, args=(speed, duration)).start()
-            self.log(f"Right magazine running at {speed}% for {duration}s")
+            if self.submit('right_tray', self.right_tray.move_motor, speed, duration):
+                self.log(f"Right magazine running at {speed}% for {duration}s")
         except ValueError:
             messagebox.showerror("Error", "Invalid input values")
 
@@ -335,8 +532,8 @@ class MotorControlGUI:
         try:
             speed = int(self.lead_screw_speed.get())
             duration = float(self.lead_screw_duration.get())
-            threading.Thread(target=self.lead_screw.move_motor, args=(speed, duration)).start()
-            self.log(f"Lead screw raising at {speed}% for {duration}s")
+            if self.submit('lead_screw', self.lead_screw.move_motor, speed, duration):
+                self.log(f"Lead screw raising at {speed}% for {duration}s")
         except ValueError:
             messagebox.showerror("Error", "Invalid input values")
 
@@ -344,8 +541,8 @@ class MotorControlGUI:
         try:
             speed = int(self.separator_speed.get())
             duration = float(self.separator_duration.get())
-            threading.Thread(target=self.sep_mod.move_motor, args=(speed, duration)).start()
-            self.log(f"Separator active at {speed}% for {duration}s")
+            if self.submit('sep_mod', self.sep_mod.move_motor, speed, duration):
+                self.log(f"Separator active at {speed}% for {duration}s")
         except ValueError:
             messagebox.showerror("Error", "Invalid input values")
 
@@ -353,20 +550,90 @@ class MotorControlGUI:
         """Emergency stop all motors"""
         self.log("Executing emergency stop...")
         try:
-            motors = [attr for attr in dir(self) if not attr.startswith('__')]
-            for motor in motors:
-                if hasattr(getattr(self, motor), 'stop_motor'):
-                    getattr(self, motor).stop_motor()
-            GPIO.cleanup()
-            self.log("Emergency stop complete")
+            # nothing that was queued before the stop should run after it
+            for worker in getattr(self, 'workers', {}).values():
+                worker.clear()
+            if self.motion:
+                report = self.motion.emergency_stop()
+            else:
+                report = MotorClass.emergency_stop()
+            if report['still_moving']:
+                self.log(f"Emergency stop: {report['still_moving']} actuators did not stop "
+                         f"within {MotorClass.ESTOP_TIMEOUT * 1e3:.0f} ms", logging.WARNING)
+            else:
+                self.log(f"Emergency stop complete, {report['moving']} moving actuators stopped "
+                         f"in {report['latency_ms']:.1f} ms. Press Reset E-Stop to move again")
         except Exception as e:
-            self.log(f"Emergency stop error: {str(e)}")
+            self.log(f"Emergency stop error: {str(e)}", logging.ERROR)
+
+    def reset_emergency_stop(self):
+        """Release the emergency stop latch"""
+        if self.motion:
+            self.motion.reset_emergency_stop()
+        else:
+            MotorClass.reset_emergency_stop()
+        self.log("Emergency stop reset")
+
+    def listen_for_updates(self):
+        """Let update.py find this process and ask it to restart into a new release"""
+        self.restart_requested = False
+        # the handler goes in first, the signal's default action would kill the GUI
+        signal.signal(update.RESTART_SIGNAL, lambda signum, frame: self.request_restart())
+        try:
+            update.write_pid()
+        except OSError as e:
+            self.log(f"Updates cannot restart the GUI: {e}", logging.WARNING)
+
+    def request_restart(self):
+        if not self.restart_requested:
+            self.restart_requested = True
+            self.log("Update installed, restarting once every actuator is idle")
+            self.root.after(0, self.check_restart)
+
+    def idle(self):
+        """True when no command is queued or running and no DC motor is left running"""
+        for name in SAFE_PINS:
+            worker = self.workers[name]
+            if worker.busy or worker.depth:
+                return False
+            motor = getattr(self, name, None)
+            if motor is None:
+                continue
+            state = motor.state
+            # DC motors started with start_motor keep turning after their ramp has finished
+            if state.busy or (ACTUATOR_TYPES[name] == 'DCMotor' and state.position):
+                return False
+        return True
+
+    def check_restart(self):
+        """Restart into the release 'current' points at now, as soon as nothing is moving"""
+        if not self.idle():
+            self.root.after(RESTART_POLL_MS, self.check_restart)
+            return
+        self.log("Restarting into the new release")
+        self.shutdown()
+        if MotorClass.store is not None:
+            MotorClass.store.flush()    # exec skips the atexit flush
+        script = os.path.join(update.CURRENT, os.path.basename(sys.argv[0]))
+        if os.path.exists(script):
+            os.chdir(update.CURRENT)
+        else:
+            script = sys.argv[0]    # not run from a release, start again the way it was started
+        os.execv(sys.executable, [sys.executable, script] + sys.argv[1:])
+
+    def shutdown(self):
+        """Stop everything and release the hardware"""
+        self.emergency_stop()
+        if self.motion:
+            self.motion.shutdown()  # the motion process cleans up its own pins
+        GPIO.cleanup()  # safe now, every motion loop has exited
+        update.remove_pid()
+        self.root.destroy()
 
     def on_closing(self):
         """Cleanup on window close"""
         if messagebox.askokcancel("Quit", "Do you want to quit?"):
-            self.emergency_stop()
-            self.root.destroy()
+            self.shutdown()
 
 
 if __name__ == "__main__":
@@ -378,4 +645,5 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"Fatal error: {str(e)}")
     finally:
-        GPIO.cleanup()
\ No newline at end of file
+        GPIO.cleanup()
+        update.remove_pid()
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""
+This script collects per actuator command metrics and exports them for Prometheus.
+
+For every actuator there are fixed bucket histograms of
+    queue_wait       - seconds between a button press and the worker starting the command
+    start_latency    - seconds between the command starting and the first pulse or duty update
+    execution        - seconds the command took
+    overrun          - seconds the command took longer than its timing model planned
+    update_lateness  - seconds each servo update went out after its deadline
+plus counters of commands and errors. Every histogram is only written by the thread running
+that actuator's commands, so observing needs no lock; readers just see slightly stale counts.
+
+The numbers can be scraped from a local HTTP endpoint or written to a Prometheus text file
+(for node_exporter's textfile collector) by setting COSMIC_METRICS_PORT or COSMIC_METRICS_FILE.
+The GUI also shows a summary on its Metrics tab.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Final
+import bisect
+import os
+import threading
+import time
+
+METRICS_PORT_ENV: Final[str] = 'COSMIC_METRICS_PORT'
+METRICS_FILE_ENV: Final[str] = 'COSMIC_METRICS_FILE'
+METRICS_FILE_INTERVAL: Final[float] = 15.0     # seconds between text file updates
+PREFIX: Final[str] = 'cosmic_command'
+
+# upper bounds in seconds, anything above the last one lands in +Inf
+BUCKETS: Final[tuple] = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                         0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+HISTOGRAMS: Final[tuple] = ('queue_wait', 'start_latency', 'execution', 'overrun', 'update_lateness')
+
+
+class Histogram:
+    """Counts per fixed bucket, plus the sum and count like a Prometheus histogram"""
+
+    def __init__(self, buckets: tuple=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket the q quantile falls in, None without observations"""
+        if not self.count:
+            return None
+        target = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            if total >= target:
+                return bound if bound != float('inf') else self.buckets[-1]
+        return self.buckets[-1]
+
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else None
+
+
+class ActuatorMetrics:
+    """Histograms and counters of one actuator"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.histograms = {kind: Histogram() for kind in HISTOGRAMS}
+        self.commands = 0
+        self.errors = 0
+        self.created = time.monotonic()
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['histograms'][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def per_hour(self) -> float:
+        hours = (time.monotonic() - self.created) / 3600
+        return self.commands / hours if hours > 0 else 0.0
+
+
+_actuators = {}
+_lock = threading.Lock()
+
+
+def actuator(name: str) -> ActuatorMetrics:
+    """Metrics of an actuator, created the first time its name is used"""
+    metrics = _actuators.get(name)
+    if metrics is None:
+        with _lock:
+            metrics = _actuators.setdefault(name, ActuatorMetrics(name))
+    return metrics
+
+
+def all_actuators() -> list:
+    return list(_actuators.values())
+
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    metrics = sorted(all_actuators(), key=lambda m: m.name)
+    for kind in HISTOGRAMS:
+        name = f"{PREFIX}_{kind}_seconds"
+        lines.append(f"# TYPE {name} histogram")
+        for m in metrics:
+            histogram = m.histograms[kind]
+            if not histogram.count:
+                continue
+            total = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                total += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{{actuator="{m.name}",le="{le}"}} {total}')
+            lines.append(f'{name}_sum{{actuator="{m.name}"}} {histogram.sum}')
+            lines.append(f'{name}_count{{actuator="{m.name}"}} {histogram.count}')
+    for counter in ('commands', 'errors'):
+        name = f"{PREFIX}_{counter}_total" if counter == 'errors' else f"{PREFIX}s_total"
+        lines.append(f"# TYPE {name} counter")
+        for m in metrics:
+            lines.append(f'{name}{{actuator="{m.name}"}} {getattr(m, counter)}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path: str):
+    """Write render() to path atomically, so a scraper never reads half a file"""
+    temp = f"{path}.tmp"
+    with open(temp, 'w') as f:
+        f.write(render())
+    os.replace(temp, path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass    # one line per scrape is just noise
+
+
+def serve(port: int, host: str='127.0.0.1') -> ThreadingHTTPServer:
+    """Serve /metrics on a background thread, returns the server so it can be shut down"""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+def start_from_env():
+    """Start the HTTP endpoint and/or text file writer asked for in the environment"""
+    port = os.environ.get(METRICS_PORT_ENV)
+    if port:
+        serve(int(port))
+    path = os.environ.get(METRICS_FILE_ENV)
+    if path:
+        def write_forever():
+            while True:
+                write_textfile(path)
+                time.sleep(METRICS_FILE_INTERVAL)
+
+        threading.Thread(target=write_forever, name='metrics-file', daemon=True).start()
@@ -0,0 +1,387 @@
+"""
+This script runs all motion in its own process, away from the Tk main loop and its GIL.
+
+The controller process owns the actuators. Clients (the GUI, test scripts) talk to it through
+two blocks of shared memory:
+
+    command ring  - single producer / single consumer ring of fixed size command slots. The
+                    producer only ever writes 'head' and the consumer only ever writes 'tail',
+                    so no lock is shared between the processes
+    state block   - one record per actuator (position, target, busy, fault bits and the
+                    sequence number of the last finished command) written with a seqlock, so
+                    readers never block the controller
+
+On Linux the controller can be pinned to a CPU and given SCHED_FIFO priority (needs root or
+CAP_SYS_NICE). The GUI uses this when COSMIC_MOTION_PROCESS=1 is set.
+"""
+
+from multiprocessing import shared_memory
+from typing import Final
+import functools
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+import time
+
+import GPIOBackend
+
+log = logging.getLogger('cosmic.motion')    # see Telemetry
+
+MOTION_PROCESS_ENV: Final[str] = 'COSMIC_MOTION_PROCESS'
+
+RING_SLOTS: Final[int] = 256
+RING_HEADER = struct.Struct('<QQ')          # head, tail
+RING_HEADER_SIZE: Final[int] = 64           # head and tail get their own cache line
+SLOT = struct.Struct('<IHHddd')             # seq, actuator index, opcode, three arguments
+
+STATE_HEADER = struct.Struct('<ddIIII')     # heartbeat, estop latency ms, estop count, moving, still moving, spare
+STATE_RECORD = struct.Struct('<IIdddII')    # version, last finished seq, position, target, velocity, busy, faults
+
+RING_POLL_S: Final[float] = 0.0005          # controller sleep while the ring is empty
+STATE_PUBLISH_S: Final[float] = 0.02        # how often the controller copies actuator snapshots out
+WAIT_POLL_S: Final[float] = 0.001           # client poll interval while waiting for a command
+ESTOP_ACK_TIMEOUT: Final[float] = 1.0
+
+# opcodes
+OP_MOVE: Final[int] = 1         # Stepper/DCMotor.move_motor(a, b)
+OP_POSITION: Final[int] = 2     # ServoMotor.change_pos(a)
+OP_OPEN: Final[int] = 3         # Solenoid.open()
+OP_CLOSE: Final[int] = 4        # Solenoid.close()
+OP_STOP_MOTOR: Final[int] = 5   # DCMotor.stop_motor()
+OP_ESTOP: Final[int] = 10       # MotorClass.emergency_stop()
+OP_RESET: Final[int] = 11       # MotorClass.reset_emergency_stop()
+OP_SHUTDOWN: Final[int] = 12
+
+# fault bits
+FAULT_COMMAND: Final[int] = 1   # the last command raised an exception
+FAULT_ESTOP: Final[int] = 2     # stopped by the emergency stop
+
+
+class CommandRing:
+    """Lock-free single producer / single consumer ring of command slots in shared memory"""
+
+    def __init__(self, name: str=None, slots: int=RING_SLOTS):
+        size = RING_HEADER_SIZE + slots * SLOT.size
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.slots = slots
+        self.buf = self.shm.buf
+        if name is None:
+            RING_HEADER.pack_into(self.buf, 0, 0, 0)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def push(self, seq: int, actuator: int, opcode: int, a: float=0.0, b: float=0.0, c: float=0.0) -> bool:
+        """Producer side, returns False if the ring is full"""
+        head, tail = RING_HEADER.unpack_from(self.buf, 0)
+        if head - tail >= self.slots:
+            return False
+        SLOT.pack_into(self.buf, RING_HEADER_SIZE + (head % self.slots) * SLOT.size, seq, actuator, opcode, a, b, c)
+        struct.pack_into('<Q', self.buf, 0, head + 1)   # publish only after the slot is written
+        return True
+
+    def pop(self):
+        """Consumer side, returns (seq, actuator, opcode, a, b, c) or None if empty"""
+        head, tail = RING_HEADER.unpack_from(self.buf, 0)
+        if tail == head:
+            return None
+        command = SLOT.unpack_from(self.buf, RING_HEADER_SIZE + (tail % self.slots) * SLOT.size)
+        struct.pack_into('<Q', self.buf, 8, tail + 1)
+        return command
+
+    def close(self, unlink: bool=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class StateBlock:
+    """Actuator state in shared memory, one seqlock protected record per actuator"""
+
+    def __init__(self, count: int, name: str=None):
+        size = STATE_HEADER.size + count * STATE_RECORD.size
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.count = count
+        self.buf = self.shm.buf
+        self.locks = [threading.Lock() for i in range(count)]    # writers in the controller process
+        if name is None:
+            self.buf[:size] = bytes(size)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def _offset(self, index: int) -> int:
+        return STATE_HEADER.size + index * STATE_RECORD.size
+
+    def write(self, index: int, **fields):
+        """Update some fields of a record. Only the controller process writes"""
+        offset = self._offset(index)
+        with self.locks[index]:
+            version, seq, position, target, velocity, busy, faults = STATE_RECORD.unpack_from(self.buf, offset)
+            current = {'seq': seq, 'position': position, 'target': target, 'velocity': velocity,
+                       'busy': busy, 'faults': faults}
+            current.update(fields)
+            # never goes back, commands dropped by the emergency stop are reported before the
+            # one running ahead of them has finished
+            current['seq'] = max(current['seq'], seq)
+            struct.pack_into('<I', self.buf, offset, version + 1)     # odd: write in progress
+            STATE_RECORD.pack_into(self.buf, offset, version + 1, current['seq'], current['position'],
+                                   current['target'], current['velocity'], int(current['busy']),
+                                   current['faults'])
+            struct.pack_into('<I', self.buf, offset, version + 2)
+
+    def read(self, index: int) -> dict:
+        """Consistent snapshot of a record, retries while the controller is writing it"""
+        offset = self._offset(index)
+        while True:
+            record = STATE_RECORD.unpack_from(self.buf, offset)
+            if record[0] % 2 == 0 and struct.unpack_from('<I', self.buf, offset)[0] == record[0]:
+                version, seq, position, target, velocity, busy, faults = record
+                return {'seq': seq, 'position': position, 'target': target, 'velocity': velocity,
+                        'busy': bool(busy), 'faults': faults}
+
+    def write_header(self, **fields):
+        current = dict(zip(('heartbeat', 'estop_latency_ms', 'estop_count', 'moving', 'still_moving', 'spare'),
+                           STATE_HEADER.unpack_from(self.buf, 0)))
+        current.update(fields)
+        STATE_HEADER.pack_into(self.buf, 0, *current.values())
+
+    def read_header(self) -> dict:
+        return dict(zip(('heartbeat', 'estop_latency_ms', 'estop_count', 'moving', 'still_moving', 'spare'),
+                        STATE_HEADER.unpack_from(self.buf, 0)))
+
+    def close(self, unlink: bool=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def set_realtime(cpu: int=None, fifo_priority: int=None) -> list:
+    """Pin this process to a CPU and/or give it SCHED_FIFO priority, returns any warnings"""
+    warnings = []
+    if cpu is not None:
+        if hasattr(os, 'sched_setaffinity'):
+            try:
+                os.sched_setaffinity(0, {cpu})
+            except OSError as e:
+                warnings.append(f"not pinned to CPU {cpu}: {e}")
+        else:
+            warnings.append("CPU affinity is not supported on this platform")
+    if fifo_priority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(fifo_priority))
+        except (AttributeError, PermissionError, OSError) as e:
+            warnings.append(f"SCHED_FIFO priority {fifo_priority} not set: {e}")
+    return warnings
+
+
+def _controller(actuators: list, ring_name: str, state_name: str, backend: str, cpu: int, fifo_priority: int):
+    """Entry point of the motion process"""
+    for warning in set_realtime(cpu, fifo_priority):
+        log.warning("Motion process: %s", warning)
+    if backend:
+        GPIOBackend.select(backend)
+    import MotorClass
+    from CommandQueue import ActuatorWorker
+
+    ring = CommandRing(ring_name)
+    state = StateBlock(len(actuators), state_name)
+    motors = []
+    workers = []
+    for index, (name, kind, pins) in enumerate(actuators):
+        motor = getattr(MotorClass, kind)(*pins)
+        motors.append(motor)
+        workers.append(ActuatorWorker(name))
+        state.write(index, position=motor.state.position, target=motor.state.target)
+
+    def execute(index: int, seq: int, opcode: int, a: float, b: float):
+        motor = motors[index]
+        state.write(index, busy=1)
+        faults = 0
+        try:
+            if opcode == OP_MOVE:
+                if isinstance(motor, MotorClass.Stepper):
+                    motor.move_motor(int(a), b)
+                else:
+                    motor.move_motor(a, b)
+            elif opcode == OP_POSITION:
+                motor.change_pos(a)
+            elif opcode == OP_OPEN:
+                motor.open()
+            elif opcode == OP_CLOSE:
+                motor.close()
+            elif opcode == OP_STOP_MOTOR:
+                motor.stop_motor()
+            if MotorClass.STOP.is_set():
+                faults |= FAULT_ESTOP
+        except Exception:
+            faults |= FAULT_COMMAND
+        snapshot = motor.state
+        state.write(index, seq=seq, busy=0, position=snapshot.position, target=snapshot.target,
+                    velocity=snapshot.velocity, faults=faults)
+
+    def dropped(index: int, seq: int):
+        """A queued command the emergency stop cleared, finish it so a client waiting on it returns"""
+        state.write(index, seq=seq, busy=0, faults=FAULT_ESTOP)
+
+    next_publish = time.monotonic()
+    try:
+        while True:
+            now = time.monotonic()
+            state.write_header(heartbeat=now)
+            if now >= next_publish:
+                # live position/target/velocity from the actuator snapshots, busy and faults
+                # belong to the commands and are written by execute()
+                for index, motor in enumerate(motors):
+                    snapshot = motor.state
+                    state.write(index, position=snapshot.position, target=snapshot.target,
+                                velocity=snapshot.velocity)
+                next_publish = now + STATE_PUBLISH_S
+            command = ring.pop()
+            if command is None:
+                time.sleep(RING_POLL_S)
+                continue
+            seq, index, opcode, a, b, c = command
+            if opcode == OP_SHUTDOWN:
+                break
+            if opcode == OP_ESTOP:
+                for worker in workers:
+                    worker.clear()
+                report = MotorClass.emergency_stop()
+                header = state.read_header()
+                state.write_header(estop_latency_ms=report['latency_ms'], estop_count=header['estop_count'] + 1,
+                                   moving=report['moving'], still_moving=report['still_moving'])
+            elif opcode == OP_RESET:
+                MotorClass.reset_emergency_stop()
+            else:
+                workers[index].submit(execute, index, seq, opcode, a, b,
+                                      on_dropped=functools.partial(dropped, index, seq))
+    finally:
+        for worker in workers:
+            worker.stop()
+        for motor in motors:
+            motor.clean()
+        MotorClass.GPIO.cleanup()
+        ring.close()
+        state.close()
+
+
+class ActuatorProxy:
+    """
+    Stands in for a MotorClass actuator in the client process. It has the same methods, which
+    send the command to the controller and by default wait for it to finish.
+    """
+
+    def __init__(self, client, index: int, name: str, kind: str):
+        self.client = client
+        self.index = index
+        self.name = name
+        self.kind = kind
+
+    @property
+    def position(self):
+        return self.client.state(self.name)['position']
+
+    @property
+    def state(self):
+        """The controller's snapshot of this actuator as a MotorClass.ActuatorState"""
+        from MotorClass import ActuatorState
+        record = self.client.state(self.name)
+        return ActuatorState(record['position'], record['target'], record['velocity'], record['busy'],
+                             'estop' if record['faults'] & FAULT_ESTOP else
+                             'error' if record['faults'] & FAULT_COMMAND else '')
+
+    def move_motor(self, a: float, b: float=None, wait: bool=True):
+        if b is None:
+            b = 0.003 if self.kind == 'Stepper' else 0.0
+        return self.client.send(self.index, OP_MOVE, a, b, wait=wait)
+
+    def change_pos(self, position: float, wait: bool=True):
+        return self.client.send(self.index, OP_POSITION, position, wait=wait)
+
+    def open(self, wait: bool=True):
+        return self.client.send(self.index, OP_OPEN, wait=wait)
+
+    def close(self, wait: bool=True):
+        return self.client.send(self.index, OP_CLOSE, wait=wait)
+
+    def stop_motor(self, wait: bool=True):
+        return self.client.send(self.index, OP_STOP_MOTOR, wait=wait)
+
+
+class MotionClient:
+    """
+    Starts the motion process and talks to it. actuators is a list of (name, MotorClass class
+    name, pins) the controller builds at start up.
+    """
+
+    def __init__(self, actuators: list, cpu: int=None, fifo_priority: int=None, backend: str=None):
+        self.actuators = [(name, kind, tuple(pins) if isinstance(pins, (list, tuple)) else (pins,))
+                          for name, kind, pins in actuators]
+        self.index = {name: i for i, (name, kind, pins) in enumerate(self.actuators)}
+        self.ring = CommandRing()
+        self.state_block = StateBlock(len(self.actuators))
+        self.lock = threading.Lock()    # one producer: client threads take turns on the ring
+        self.seq = 0
+        context = multiprocessing.get_context('spawn')     # never fork the Tk process
+        self.process = context.Process(
+            target=_controller, name='motion-controller', daemon=True,
+            args=(self.actuators, self.ring.name, self.state_block.name,
+                  backend or GPIOBackend.backend_name(), cpu, fifo_priority))
+        self.process.start()
+
+    def actuator(self, name: str) -> ActuatorProxy:
+        return ActuatorProxy(self, self.index[name], name, self.actuators[self.index[name]][1])
+
+    def send(self, index: int, opcode: int, a: float=0.0, b: float=0.0, c: float=0.0, wait: bool=False) -> int:
+        """Queue a command, optionally block until the controller has finished it"""
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+            while not self.ring.push(seq, index, opcode, a, b, c):
+                time.sleep(WAIT_POLL_S)     # ring full, the controller is behind
+        if wait:
+            while self.state_block.read(index)['seq'] < seq:
+                if not self.process.is_alive():
+                    raise RuntimeError("Motion process has died")
+                time.sleep(WAIT_POLL_S)
+            if self.state_block.read(index)['faults'] & FAULT_COMMAND:
+                raise RuntimeError(f"{self.actuators[index][0]}: command failed in the motion process")
+        return seq
+
+    def state(self, name: str) -> dict:
+        return self.state_block.read(self.index[name])
+
+    def emergency_stop(self) -> dict:
+        """Same report as MotorClass.emergency_stop, measured inside the motion process"""
+        count = self.state_block.read_header()['estop_count']
+        self.send(0, OP_ESTOP)
+        deadline = time.monotonic() + ESTOP_ACK_TIMEOUT
+        while self.state_block.read_header()['estop_count'] == count:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Motion process did not acknowledge the emergency stop")
+            time.sleep(WAIT_POLL_S / 10)
+        header = self.state_block.read_header()
+        return {
+            'actuators': len(self.actuators),
+            'moving': header['moving'],
+            'still_moving': header['still_moving'],
+            'latency_ms': header['estop_latency_ms'],
+        }
+
+    def reset_emergency_stop(self):
+        self.send(0, OP_RESET)
+
+    def shutdown(self, timeout: float=5.0):
+        """Stop the controller, clean up its pins and free the shared memory"""
+        if self.process.is_alive():
+            self.send(0, OP_SHUTDOWN)
+            self.process.join(timeout)
+        self.ring.close(unlink=True)
+        self.state_block.close(unlink=True)
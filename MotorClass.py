@@ -11,9 +11,29 @@ input and output variables so that we do not have to continue to reinitialize th
 All other motor classes can be created as a subclass of 'Motor'.
 """
 
-import RPi.GPIO as GPIO
-from typing import Final
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+from typing import Final, NamedTuple
+import asyncio
+import atexit
+import functools
+import heapq
+import logging
+import math
+import threading
 import time
+import weakref
+import FlightRecorder
+import GPIOBackend
+import Metrics
+import StateStore
+
+GPIO = GPIOBackend.load()   # RPi.GPIO unless another backend is selected, see GPIOBackend
+GPIO = FlightRecorder.from_env(GPIO)    # records every pin change if COSMIC_FLIGHT_RECORDER is set
+CLOCK = getattr(GPIO, 'clock', time)    # simulated backends bring their own clock
+log = logging.getLogger('cosmic.motion')    # see Telemetry for where these messages end up
 
 NEUTRAL: Final[int] = 0 #this is an assumption on servo neutral position
 
@@ -25,8 +45,449 @@ SMALL_MIN: Final[float] = 1e-3       #in seconds
 SMALL_MAX: Final[float] = 4e-3          # seconds
 SMALL_FREQ: Final[int] = SERVO_FREQ        # Hz
 
+# servo slew limits in position units (0-100) per second, tune these on the rig
+SERVO_SLEW_RATE: Final[float] = 100.0
+SMALL_SLEW_RATE: Final[float] = 50.0
+SERVO_UPDATE_RATE: Final[float] = SERVO_FREQ     # Hz, updating faster than the PWM period is pointless
+LUT_RESOLUTION: Final[int] = 10                  # duty table entries per position unit
+
+# threads of the pulse driver that runs stepper pulse trains for the asyncio API,
+# one per torque arm so the two steppers can overlap
+PULSE_DRIVER_THREADS: Final[int] = 2
+
+# time.sleep on the Pi regularly overshoots by a few hundred microseconds, so the last
+# stretch before every step edge is busy-waited instead of slept
+SPIN_THRESHOLD_NS: Final[int] = 300_000
+_spin_ns = getattr(CLOCK, 'spin_threshold_ns', SPIN_THRESHOLD_NS)    # a virtual clock never needs to spin
+
+STEP_DELAY: Final[float] = 0.003                  # default half period of a step pulse, seconds
+TRAJECTORY_CACHE_BYTES: Final[int] = 16 * 1024 * 1024     # memory budget of the compiled move cache
+START_RATE: Final[float] = 1 / (2 * STEP_DELAY)   # steps/s the steppers reliably start at
+
+ESTOP_TIMEOUT: Final[float] = 0.1     # seconds emergency_stop waits for motion loops to exit
+STATE_PUBLISH_STEPS: Final[int] = 64  # a moving stepper publishes its position every this many steps
+
+DC_FREQ: Final[int] = 50                #check to see if frequency is correct
+DC_ACCEL: Final[float] = None           # duty %/s for DC ramps, None changes speed instantly like before
+DC_RAMP_RATE: Final[float] = 50         # Hz, duty updates per second while ramping
+DC_BRAKE_TIME: Final[float] = 0.05      # seconds both channels are held HIGH when reversing
+
+# Emergency stop token shared by every actuator. Every pulse and update loop checks it and
+# exits as soon as it is set. It stays set (latched) until reset_emergency_stop() is called
+STOP = threading.Event()
+# a real sleep has to wake up the moment STOP is set, the virtual clock just skips ahead
+_sleep = STOP.wait if CLOCK is time else CLOCK.sleep
+
+_registry = weakref.WeakSet()   # every live actuator, see live_actuators()
+
+# positions survive restarts in here, None on simulated backends unless COSMIC_STATE_FILE is set
+store = StateStore.default(GPIOBackend.backend_name())
+if store is not None:
+    atexit.register(store.flush)
+_mode_lock = threading.Lock()
+
+
+def wait_until(deadline_ns: int) -> int:
+    """
+    Block until CLOCK.perf_counter_ns() reaches deadline_ns.
+
+    Most of the wait is a normal sleep, only the final SPIN_THRESHOLD_NS is spun so we
+    do not burn a whole core for long waits. Returns how late we were in nanoseconds, or
+    straight away if the emergency stop is set.
+    """
+    remaining = deadline_ns - CLOCK.perf_counter_ns()
+    if remaining > _spin_ns:
+        _sleep((remaining - _spin_ns) / 1e9)
+        if STOP.is_set():
+            return 0
+    now = CLOCK.perf_counter_ns()
+    while now < deadline_ns:
+        now = CLOCK.perf_counter_ns()
+    return now - deadline_ns
+
+
+def setup_gpio():
+    """
+    Select BOARD numbering if nothing has been selected yet. Done by the first actuator
+    that is built instead of at import, so importing MotorClass never touches the hardware.
+    """
+    with _mode_lock:
+        if GPIO.getmode() is None:
+            GPIO.setmode(GPIO.BOARD)
+
+
+def live_actuators() -> list:
+    """Every actuator that has been created and not garbage collected"""
+    return list(_registry)
+
+
+def emergency_stop(timeout: float=ESTOP_TIMEOUT) -> dict:
+    """
+    Stop every actuator. Sets the shared STOP token, halts the hardware of every live
+    actuator and waits up to 'timeout' for all running motion loops to exit. Returns the
+    measured stop latency: the time from the call until the last loop had stopped (and so
+    the last edge was written), in milliseconds.
+    """
+    start = CLOCK.perf_counter_ns()
+    STOP.set()
+    actuators = live_actuators()
+    moving = [m for m in actuators if m.busy]
+    for motor in actuators:
+        motor.halt()
+    halted = CLOCK.perf_counter_ns()
+
+    deadline = time.perf_counter() + timeout
+    while any(m.busy for m in moving) and time.perf_counter() < deadline:
+        time.sleep(0.0005)
+    still_moving = [m for m in moving if m.busy]
+    last = max([halted] + [m.stopped_at for m in moving if not m.busy and m.stopped_at is not None])
+    return {
+        'actuators': len(actuators),
+        'moving': len(moving),
+        'still_moving': len(still_moving),     # anything here missed the timeout
+        'latency_ms': (last - start) / 1e6,
+    }
+
+
+def reset_emergency_stop():
+    """Clear the STOP token so the actuators can move again"""
+    STOP.clear()
+
+
+class DeadlineTimer:
+    """
+    One shared thread that calls functions at given CLOCK deadlines. DC motor ramps and timed
+    runs are scheduled on it, so a running tray or lead screw does not tie up a thread of
+    its own.
+    """
+
+    def __init__(self):
+        self._queue = []
+        self._count = 0     # tie breaker so the heap never compares functions
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def call_at(self, deadline_ns: int, func, *args):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='deadline-timer', daemon=True)
+                self._thread.start()
+            self._count += 1
+            heapq.heappush(self._queue, (deadline_ns, self._count, func, args))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                deadline, count, func, args = self._queue[0]
+                remaining = deadline - CLOCK.perf_counter_ns()
+                if remaining > 0:
+                    self._cond.wait(remaining / 1e9)
+                    continue
+                heapq.heappop(self._queue)
+            try:
+                func(*args)
+            except Exception:
+                # every DC motor shares this thread, one bad call must not stop the others
+                log.exception("Scheduled call %s failed", getattr(func, '__qualname__', func))
+
+
+timer = DeadlineTimer()
+
+
+class _AnyEvent:
+    """is_set() of several events at once, for backends that poll a single cancel event"""
+
+    def __init__(self, *events):
+        self.events = [e for e in events if e is not None]
+
+    def is_set(self) -> bool:
+        return any(e.is_set() for e in self.events)
+
+
+class StepProfile:
+    """
+    Acceleration profile for a Stepper.
+
+    The motor starts at start_rate, ramps up to max_rate at 'accel' and ramps back down
+    at the end of the move (trapezoid). If jerk is given the acceleration itself is ramped
+    as well, which gives an S-curve. Rates are in steps/s, accel in steps/s^2 and jerk in
+    steps/s^3.
+    """
+
+    def __init__(self, max_rate: float, accel: float, jerk: float=None, start_rate: float=START_RATE):
+        if max_rate <= 0 or accel <= 0 or start_rate <= 0:
+            raise ValueError("max_rate, accel and start_rate must be positive")
+        if jerk is not None and jerk <= 0:
+            raise ValueError("jerk must be positive")
+        self.max_rate = max_rate
+        self.accel = accel
+        self.jerk = jerk
+        self.start_rate = min(start_rate, max_rate)
+        self.key = (self.max_rate, self.accel, self.jerk, self.start_rate)     # for the trajectory cache
+
+    def ramp(self, max_steps: int) -> array:
+        """Step periods (seconds) of the acceleration ramp, at most max_steps long"""
+        periods = array('d')
+        rate = self.start_rate
+        accel = self.accel if self.jerk is None else 0.0
+        while rate < self.max_rate and len(periods) < max_steps:
+            dt = 1 / rate
+            periods.append(dt)
+            if self.jerk is not None:
+                # start easing the acceleration off early enough to hit max_rate with zero accel
+                if self.max_rate - rate <= accel * accel / (2 * self.jerk):
+                    accel = max(accel - self.jerk * dt, self.jerk * dt)
+                else:
+                    accel = min(accel + self.jerk * dt, self.accel)
+            rate = min(rate + accel * dt, self.max_rate)
+        return periods
+
+    def intervals(self, steps: int) -> array:
+        """
+        Precompute the period of every step in a move of 'steps' steps. The deceleration is
+        the acceleration ramp mirrored; short moves that never reach max_rate are cut into a
+        triangle (for S-curves that means the jerk limit is not kept at the peak).
+        """
+        ramp = self.ramp(steps // 2)
+        cruise = steps - 2 * len(ramp)
+        if len(ramp) < steps // 2:      # reached max_rate, cruise for the rest
+            cruise_period = 1 / self.max_rate
+        elif ramp:                      # triangle, an odd middle step stays at the peak
+            cruise_period = ramp[-1]
+        else:                           # single step
+            cruise_period = 1 / self.start_rate
+        periods = array('d', ramp)
+        periods.extend(array('d', [cruise_period]) * cruise)
+        ramp.reverse()
+        periods.extend(ramp)
+        return periods
+
+
+def plan_slew(start: float, target: float, slew_rate: float, update_rate: float) -> array:
+    """
+    Plan a servo move from start to target. Returns the position to send on every tick of
+    an update_rate timer, never moving more than slew_rate units per second. Positions are
+    not rounded, so the duty cycle is changed at the finest resolution the PWM takes.
+    """
+    if slew_rate <= 0 or update_rate <= 0:
+        raise ValueError("slew_rate and update_rate must be positive")
+    distance = target - start
+    ticks = max(1, math.ceil(abs(distance) * update_rate / slew_rate))
+    increment = distance / ticks
+    path = array('d', [start + increment * (i + 1) for i in range(ticks)])
+    path[-1] = target   # no float drift on the final position
+    return path
+
+
+class TrajectoryCache:
+    """
+    LRU cache of compiled moves. The assembly cycle repeats the same pivots and servo moves
+    over and over, so the step periods and duty sequences are only computed the first time.
+
+    Values are tuples of read only memoryviews (plus small extras), keyed on everything the
+    move depends on. Least recently used entries are dropped once the compiled data takes
+    more than 'budget' bytes. hits, misses and evictions are counted for the benchmarks.
+    """
+
+    def __init__(self, budget: int=TRAJECTORY_CACHE_BYTES):
+        self.budget = budget
+        self.entries = OrderedDict()    # key -> (value, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, compile_move):
+        """The cached value for key, calling compile_move() to make it on a miss"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        value = compile_move()      # outside the lock, other actuators keep hitting meanwhile
+        size = sum(getattr(part, 'nbytes', 0) for part in value)
+        if size > self.budget:
+            return value            # would push everything else out, use it once
+        with self._lock:
+            if key not in self.entries:
+                self.entries[key] = (value, size)
+                self.size += size
+                while self.size > self.budget:
+                    old, (old_value, old_size) = self.entries.popitem(last=False)
+                    self.size -= old_size
+                    self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'budget': self.budget,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+trajectories = TrajectoryCache()
+
+
+def _frozen(values: array) -> memoryview:
+    return memoryview(values).toreadonly()
+
+
+def compile_steps(steps: int, delay: float=None, profile: StepProfile=None) -> tuple:
+    """
+    (periods in seconds, half periods in ns) of a move of 'steps' steps, from the profile if
+    one is given and no delay, otherwise at the constant delay. Cached in 'trajectories'.
+    """
+    if delay is not None or profile is None:
+        profile = None
+        delay = STEP_DELAY if delay is None else delay
+
+    def build():
+        if profile is not None:
+            periods = profile.intervals(steps)
+        else:
+            periods = array('d', [2 * delay]) * steps
+        half_periods = array('q', [int(p * 5e8) for p in periods])    # ns, HIGH and LOW are equal halves
+        return _frozen(periods), _frozen(half_periods)
+
+    return trajectories.get(('steps', steps, delay, profile.key if profile else None), build)
+
+
+_pulse_driver = None
+
+
+def pulse_driver() -> ThreadPoolExecutor:
+    """
+    The dedicated driver that runs timing critical pulse trains for the asyncio API. It is
+    created on first use so plain scripts never start its threads.
+    """
+    global _pulse_driver
+    if _pulse_driver is None:
+        _pulse_driver = ThreadPoolExecutor(max_workers=PULSE_DRIVER_THREADS, thread_name_prefix='pulse-driver')
+    return _pulse_driver
+
+
+async def _run_on_driver(func, *args, **kwargs):
+    """
+    Run a blocking motion function on the pulse driver and wait for it. func must accept a
+    'cancel' threading.Event. If the awaiting task is cancelled the event is set and we
+    wait for func to actually return before passing the cancellation on, so the pins are
+    never left mid-pulse.
+    """
+    cancel = threading.Event()
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(pulse_driver(), lambda: func(*args, cancel=cancel, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancel.set()
+        await future
+        raise
+
+
+class ServoCalibration:
+    """
+    Calibration record for a single servo.
+
+    min_pulse and max_pulse are the pulse widths (microseconds) at position 0 and 100.
+    points is an optional list of (position, pulse width) pairs measured in between, used
+    to correct servos that are not linear. Positions outside 0-100 are extrapolated from
+    the end segments.
+    """
+
+    def __init__(self, min_pulse: float, max_pulse: float, freq: int=SERVO_FREQ, points: list=None):
+        self.min_pulse = min_pulse
+        self.max_pulse = max_pulse
+        self.freq = freq
+        points = sorted(points or [])
+        if any(not 0 < pos < 100 for pos, pulse in points):
+            raise ValueError("correction points must lie strictly between positions 0 and 100")
+        self.points = [(0, min_pulse)] + points + [(100, max_pulse)]
+        self.key = (freq, tuple(self.points))   # for the trajectory cache
+        self.table = None
+
+    def pulse_width(self, position: float) -> float:
+        """Pulse width in microseconds, interpolated between the calibration points"""
+        points = self.points
+        i = 1
+        while i < len(points) - 1 and position > points[i][0]:
+            i += 1
+        (x0, y0), (x1, y1) = points[i - 1], points[i]
+        return y0 + (position - x0) * (y1 - y0) / (x1 - x0)
+
+    def duty(self, position: float) -> float:
+        """Duty cycle in percent for a position"""
+        return self.pulse_width(position) * self.freq / 1e6 * 100
+
+    def build_table(self) -> array:
+        """
+        Position -> duty table with LUT_RESOLUTION entries per position unit. The table is
+        built once and shared by every servo using this calibration.
+        """
+        if self.table is None:
+            self.table = array('d', [self.duty(i / LUT_RESOLUTION) for i in range(100 * LUT_RESOLUTION + 1)])
+        return self.table
 
-GPIO.setmode(GPIO.BOARD)
+
+SERVO_CALIBRATION = ServoCalibration(SERVO_MIN, SERVO_MAX, SERVO_FREQ)
+SMALL_CALIBRATION = ServoCalibration(SMALL_MIN * 1e6, SMALL_MAX * 1e6, SMALL_FREQ)
+
+
+class ActuatorState(NamedTuple):
+    """
+    Snapshot of an actuator, see Motor.publish. Steppers count steps, servos use position
+    units (0-100). DC motors have no position, they report the applied speed as position
+    and the commanded speed as target.
+    """
+    position: float = 0
+    target: float = 0
+    velocity: float = 0.0   # position units per second while moving
+    busy: bool = False
+    fault: str = ''         # 'estop' if the last motion was cut short by the emergency stop
+    updated: int = 0        # CLOCK.perf_counter_ns() of the last publish
+
+
+def instrumented(func):
+    """
+    Record every call of an actuator entry point in Metrics: the command count, errors, how
+    long it took and how far it ran over the actuator's timing model (move_time), if it has one.
+    Start latency is recorded by the actuator itself, see Motor.started.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        metrics = self.metrics
+        metrics.commands += 1
+        model = getattr(self, 'move_time', None)
+        planned = None
+        self._entered = entered = CLOCK.perf_counter_ns()
+        try:
+            if model is not None:
+                planned = model(*args, **kwargs)    # a cache hit, and warms the cache if not
+            return func(self, *args, **kwargs)
+        except Exception:
+            metrics.errors += 1
+            raise
+        finally:
+            self._entered = None
+            elapsed = (CLOCK.perf_counter_ns() - entered) / 1e9
+            metrics.execution.observe(elapsed)
+            if planned is not None:
+                metrics.overrun.observe(max(0.0, elapsed - planned))
+    return wrapper
 
 
 class Motor:
@@ -34,7 +495,14 @@ class Motor:
     This class defines all motors used in the project.
 
     It should be used as a parent class where other motors will be subclasses of 'Motor'.
+
+    Motor also keeps the shadow register: the last level written to every output pin and the
+    last duty sent to every PWM pin. It is shared by all actuators, like the pins are. Writes
+    through write() and set_duty() that would not change anything never reach the backend,
+    and write() sends every pin that does change in one batched call.
     """
+    levels = {}     # pin -> last level written, missing while unknown
+    duties = {}     # pin -> last duty sent to its running PWM
 
     def __init__(self, out_pin1: int, out_pin2: int=None, out_pin3: int=None):
         """
@@ -42,8 +510,10 @@ class Motor:
 
         :param out_pin: GPIO pin number assigned to the motor output.
         """
+        setup_gpio()
         self.output1 = out_pin1
         GPIO.setup(self.output1, GPIO.OUT)  # Configure pin as output
+        Motor.forget(out_pin1, out_pin2, out_pin3)  # whatever they were at is unknown now
 
         if out_pin2 is not None:
             self.output2 = out_pin2
@@ -57,91 +527,480 @@ class Motor:
         else:
             self.output3 = None
 
+        self.busy = False       # True while a motion loop is running on this actuator
+        self.stopped_at = None  # CLOCK time the last motion loop exited
+        self.state = ActuatorState()
+        self.state_key = None   # set by actuators whose position is kept in the state store
+        self.name = f"{type(self).__name__}:{out_pin1}"     # what its metrics are filed under
+        self._entered = None    # CLOCK time the running instrumented command was called
+        _registry.add(self)
+
+    @property
+    def metrics(self) -> Metrics.ActuatorMetrics:
+        return Metrics.actuator(self.name)
+
+    def started(self):
+        """Called at the first pulse or duty update of a command, records its start latency once"""
+        entered, self._entered = self._entered, None
+        if entered is not None:
+            self.metrics.start_latency.observe((CLOCK.perf_counter_ns() - entered) / 1e9)
+
+    def publish(self, **changes):
+        """
+        Replace the state snapshot with an updated copy. Readers just take self.state, the
+        swap is a single assignment so neither side ever waits on a lock.
+        """
+        self.state = self.state._replace(updated=CLOCK.perf_counter_ns(), **changes)
+
+    def save(self, moving: bool=False):
+        """
+        Record the position in the state store. Called with moving=True before a move and
+        without after it, so a crash part way through is never mistaken for a known position.
+        """
+        if store is not None and self.state_key:
+            store.write(self.state_key, self.position, self.state.target,
+                        StateStore.MOVING if moving else StateStore.IDLE)
+
+    def restore(self):
+        """Position saved by the last run, None if there is none or it cannot be trusted"""
+        if store is None or not self.state_key:
+            return None
+        record = store.read(self.state_key)
+        if record is None:
+            return None
+        position, target, flags = record
+        if flags == StateStore.MOVING:
+            log.warning("%s was moving when the last run ended, it has to be homed", self.state_key)
+            return None
+        log.info("%s restored at position %g", self.state_key, position)
+        return position
+
+    @contextmanager
+    def motion(self):
+        """Wrap every motion loop in this so emergency_stop can see it running and wait for it"""
+        self.busy = True
+        self.publish(busy=True, fault='')
+        try:
+            yield
+        finally:
+            self.busy = False
+            self.stopped_at = CLOCK.perf_counter_ns()
+            self.publish(busy=False, velocity=0.0, fault='estop' if STOP.is_set() else '')
+
+    @staticmethod
+    def write(pins, levels, force: bool=False) -> int:
+        """
+        Drive a pin to a level, or a list of pins to a list of levels (or all to one level),
+        in one backend call. Pins the shadow register says are already there are left out
+        unless force is set. Returns the number of pins written.
+        """
+        if not isinstance(pins, (list, tuple)):
+            pins, levels = [pins], [levels]
+        elif not isinstance(levels, (list, tuple)):
+            levels = [levels] * len(pins)
+        changed = [(pin, level) for pin, level in zip(pins, levels) if force or Motor.levels.get(pin) != level]
+        if len(changed) == 1:
+            GPIO.output(*changed[0])
+        elif changed:
+            GPIO.output([pin for pin, level in changed], [level for pin, level in changed])
+        for pin, level in changed:
+            Motor.levels[pin] = level
+        return len(changed)
+
+    @staticmethod
+    def set_duty(pwm, pin: int, duty: float) -> bool:
+        """ChangeDutyCycle unless pin's PWM already runs at that duty, returns whether it was sent"""
+        if Motor.duties.get(pin) == duty:
+            return False
+        pwm.ChangeDutyCycle(duty)
+        Motor.duties[pin] = duty
+        return True
+
+    @staticmethod
+    def forget(*pins):
+        """Drop the shadow of pins whose state changed outside write(), e.g. by a PWM or cleanup"""
+        for pin in pins:
+            Motor.levels.pop(pin, None)
+            Motor.duties.pop(pin, None)
+
+    def pins(self) -> list:
+        return [pin for pin in (self.output1, self.output2, self.output3) if pin is not None]
+
+    def halt(self):
+        """Immediate hardware stop used by emergency_stop, drives every output LOW whatever the shadow says"""
+        Motor.write(self.pins(), GPIO.LOW, force=True)
+
     def clean(self):
-        GPIO.output(self.output1, GPIO.LOW)
-        if self.output2 is not None:
-            GPIO.output(self.output2, GPIO.LOW)
-        if self.output3 is not None:
-            GPIO.output(self.output3, GPIO.LOW)
+        # forced like halt(), clean up is the one write that must happen whatever the shadow says
+        Motor.write(self.pins(), GPIO.LOW, force=True)
 
 
 
 class ServoMotor(Motor):
-    def __init__(self, pwm_pin: int):
+    HOME = NEUTRAL      # position assumed and sent on start up when the state store has none
+
+    def __init__(self, pwm_pin: int, calibration: ServoCalibration=None):
         super().__init__(pwm_pin)
         self.pwm_pin = pwm_pin
-        self.pwm = GPIO.PWM(self.pwm_pin, SERVO_FREQ)
-        self.pwm.start(100)
-
-
-    def change_pos(self, position: int):
-        """Method to change the position of as servo"""
-        current_pos = self.position
-        new_pos = position
-        difference = new_pos - current_pos
-        if difference < 0:
-            for i in range(abs(difference)):
-                self.step_up(current_pos-i)
-                time.sleep(0.1)
-                self.position = current_pos-i
-        if difference > 0:
-            for i in range(abs(difference)):
-                self.step_up(current_pos+i)
-                time.sleep(0.1)
-                self.position = current_pos+i
-
-    def step_up(self, position: int):
-        """Method to change the position of as servo"""
-        #state = servo_setting(position)
-        Pulse_width = ((position/100)*2000)+500
-        state = (Pulse_width*(SERVO_FREQ/1000000))*100
-        #print(state)
-        self.pwm.ChangeDutyCycle(state)
-        time.sleep(0.1)
+        self.calibration = calibration or SERVO_CALIBRATION
+        self.duty_table = self.calibration.build_table()
+        if hasattr(GPIO, 'attach_servo'):     # simulated backends model the servo
+            GPIO.attach_servo(pwm_pin, self.calibration.min_pulse, self.calibration.max_pulse)
+        self.slew_rate = SERVO_SLEW_RATE
+        self.state_key = f"{type(self).__name__}:{pwm_pin}"
+        position = self.restore()
+        self.restored = position is not None
+        self.position = position if self.restored else self.HOME
+        # start straight at the duty of the known position, no full duty kick on start up
+        self.pwm = GPIO.PWM(self.pwm_pin, self.calibration.freq)
+        self.pwm.start(self.duty_at(self.position))
+        Motor.duties[pwm_pin] = self.duty_at(self.position)
+        self.publish(position=self.position, target=self.position)
+
+    @instrumented
+    def change_pos(self, position: float, slew_rate: float=None, update_rate: float=SERVO_UPDATE_RATE,
+                   direct: bool=False):
+        """
+        Method to change the position of a servo.
+
+        The move is planned with plan_slew and sent on a fixed update_rate timer. slew_rate
+        defaults to self.slew_rate (position units per second). With direct=True the servo
+        is sent straight to the target duty and moves as fast as it physically can.
+        """
+        if direct:
+            if not STOP.is_set():
+                self.step_up(position)
+                self.started()
+                self.position = position
+                self.publish(position=position, target=position)
+                self.save()
+            return
+
+        path, duties = self.compile_slew(self.position, position, slew_rate or self.slew_rate, update_rate)
+        period = int(1e9 / update_rate)
+        lateness = self.metrics.update_lateness
+        with self.motion():
+            self.publish(target=position, velocity=slew_rate or self.slew_rate)
+            self.save(moving=True)
+            deadline = CLOCK.perf_counter_ns()
+            for pos, duty in zip(path, duties):
+                lateness.observe(wait_until(deadline) / 1e9)
+                if STOP.is_set():
+                    break
+                self.set_duty(self.pwm, self.pwm_pin, duty)
+                self.started()
+                self.position = pos
+                self.publish(position=pos)
+                deadline += period
+        self.save()
+
+    def move_time(self, position: float, slew_rate: float=None, update_rate: float=SERVO_UPDATE_RATE,
+                  direct: bool=False, start: float=None) -> float:
+        """Seconds change_pos takes with these arguments, starting from 'start' (default the current position)"""
+        if direct:
+            return 0.0
+        path, duties = self.compile_slew(self.position if start is None else start, position,
+                                         slew_rate or self.slew_rate, update_rate)
+        return (len(path) - 1) / update_rate    # the first update goes out straight away
+
+    async def move_to(self, position: float, slew_rate: float=None, update_rate: float=SERVO_UPDATE_RATE,
+                      direct: bool=False):
+        """
+        Awaitable version of change_pos. Updates are timed by the event loop, so any number
+        of servo moves can overlap without a thread each. Cancelling the task stops the
+        servo where it is and self.position holds the last position that was sent.
+        """
+        if direct:
+            if not STOP.is_set():
+                self.step_up(position)
+                self.position = position
+                self.publish(position=position, target=position)
+                self.save()
+            return
+
+        path, duties = self.compile_slew(self.position, position, slew_rate or self.slew_rate, update_rate)
+        loop = asyncio.get_running_loop()
+        period = 1 / update_rate
+        with self.motion():
+            self.publish(target=position, velocity=slew_rate or self.slew_rate)
+            self.save(moving=True)
+            deadline = loop.time()
+            for pos, duty in zip(path, duties):
+                delay = deadline - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if STOP.is_set():
+                    break
+                self.set_duty(self.pwm, self.pwm_pin, duty)
+                self.position = pos
+                self.publish(position=pos)
+                deadline += period
+        self.save()
+
+    def duty_at(self, position: float) -> float:
+        """Duty cycle for a position, from the table where possible"""
+        index = round(position * LUT_RESOLUTION)
+        if 0 <= index < len(self.duty_table):
+            return self.duty_table[index]
+        return self.calibration.duty(position)   # outside 0-100, not worth a table entry
+
+    def compile_slew(self, start: float, target: float, slew_rate: float, update_rate: float) -> tuple:
+        """(positions, duty cycles) of every update of a move, see plan_slew. Cached in 'trajectories'"""
+        def build():
+            path = plan_slew(start, target, slew_rate, update_rate)
+            return _frozen(path), _frozen(array('d', [self.duty_at(pos) for pos in path]))
+
+        return trajectories.get(('slew', self.calibration.key, start, target, slew_rate, update_rate), build)
+
+    def step_up(self, position: float):
+        """Send a single position update to the servo. Timing is left to change_pos"""
+        self.set_duty(self.pwm, self.pwm_pin, self.duty_at(position))
+
+    def halt(self):
+        """Servos hold where they are on an emergency stop, they just get no more updates"""
 
     def clean(self):
         self.pwm.stop()
         GPIO.cleanup(self.pwm_pin)
+        Motor.forget(self.pwm_pin)
 
 class DCMotor(Motor):
-    """Class that will define how DC motors will behave"""
-    def __init__(self, in_pin1: int, in_pin2: int):
+    """
+    Class that will define how DC motors will behave
+
+    Both PWM channels are started once and keep running for the life of the motor, speed is
+    only ever changed with ChangeDutyCycle. Speed changes ramp at 'accel' (duty %/s, None for
+    instant) and a change of direction goes through a brake phase with both channels HIGH.
+    Timed runs are played out by the shared DeadlineTimer, so start_run returns straight away.
+    """
+    def __init__(self, in_pin1: int, in_pin2: int, accel: float=DC_ACCEL, brake_time: float=DC_BRAKE_TIME):
         super().__init__(in_pin1, in_pin2)
         self.IN1 = in_pin1
         self.IN2 = in_pin2
+        self.accel = accel
+        self.brake_time = brake_time
+        self.speed = 0          # signed duty currently applied
 
-        self.pwm1 = GPIO.PWM(self.IN1, 50)   #check to see if frequency is correct
-        self.pwm2 = GPIO.PWM(self.IN2, 50)  # check to see if frequency is correct
+        self.pwm1 = GPIO.PWM(self.IN1, DC_FREQ)
+        self.pwm2 = GPIO.PWM(self.IN2, DC_FREQ)
+        self.pwm1.start(0)
+        self.pwm2.start(0)
+        Motor.duties[in_pin1] = Motor.duties[in_pin2] = 0
 
+        self._lock = threading.Lock()
+        self._generation = 0    # bumped by every new command so stale timer calls are dropped
+        self._done = threading.Event()
+        self._done.set()
+        self._on_done = None
 
-    def move_motor(self, speed: int, run_time: float):
+    def _apply(self, speed):
+        """Set the duty of both channels, speed is signed duty or 'brake'"""
+        if speed == 'brake':
+            self.set_duty(self.pwm1, self.IN1, 100)
+            self.set_duty(self.pwm2, self.IN2, 100)
+            return
+        # only the channel that changes is sent, the other one usually already sits at 0
         if speed < 0:
-            speed = speed*-1
-            self.pwm1.start(0)
-            self.pwm2.start(speed)
-            time.sleep(run_time)
-            self.stop_motor()
-
+            self.set_duty(self.pwm1, self.IN1, 0)
+            self.set_duty(self.pwm2, self.IN2, -speed)
         else:
-            self.pwm2.start(0)
-            self.pwm1.start(speed)
-            time.sleep(run_time)
+            self.set_duty(self.pwm2, self.IN2, 0)
+            self.set_duty(self.pwm1, self.IN1, speed)
+        self.speed = speed
+        self.publish(position=speed)
+
+    def plan(self, start: float, target: float, offset: float=0.0) -> list:
+        """
+        (time offset, speed) steps that take the motor from start to target, braking in
+        between if the direction changes.
+        """
+        steps = []
+        t = offset
+        increment = self.accel / DC_RAMP_RATE if self.accel else None
+        speed = start
+
+        def ramp_to(goal):
+            nonlocal t, speed
+            if increment is None:
+                speed = goal
+                steps.append((t, speed))
+                return
+            while speed != goal:
+                speed = min(speed + increment, goal) if goal > speed else max(speed - increment, goal)
+                steps.append((t, speed))
+                t += 1 / DC_RAMP_RATE
+
+        if start * target < 0:
+            ramp_to(0)
+            steps.append((t, 'brake'))
+            t += self.brake_time
+            steps.append((t, 0))
+            speed = 0
+        ramp_to(target)
+        if not steps:
+            steps.append((t, target))
+        return steps
+
+    def _play(self, steps: list, on_done=None):
+        """
+        Apply the planned steps. On the real clock they go to the DeadlineTimer and this
+        returns immediately; on a simulated clock they are played inline.
+        """
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            self._done.clear()
+            self._on_done = on_done
+            self.busy = True
+            self.publish(busy=True, fault='')
+            if STOP.is_set():
+                self._estopped()
+                return
+        start = CLOCK.perf_counter_ns()
+        if CLOCK is not time:
+            for i, (t, speed) in enumerate(steps):
+                _sleep(max(0, start + int(t * 1e9) - CLOCK.perf_counter_ns()) / 1e9)
+                self._step(generation, speed, i == len(steps) - 1)
+            return
+        for i, (t, speed) in enumerate(steps):
+            timer.call_at(start + int(t * 1e9), self._step, generation, speed, i == len(steps) - 1)
+
+    def _step(self, generation: int, speed, last: bool):
+        with self._lock:
+            if generation != self._generation:
+                return
+            if STOP.is_set():
+                self._estopped()
+                return
+            try:
+                self._apply(speed)
+            except Exception:
+                # drop the rest of the command and release whoever waits for it
+                self._generation += 1
+                self._finish()
+                raise
+            self.started()
+            if last:
+                self._finish()
+
+    def _estopped(self):
+        """
+        Drop the rest of the command because STOP is set, called with self._lock held. halt()
+        does the same, but an emergency stop between start_run's check and _play comes before it.
+        """
+        self._generation += 1
+        self.publish(fault='estop')
+        self._finish()
+
+    def _finish(self):
+        """Mark the current command finished, called with self._lock held"""
+        self.busy = False
+        self.stopped_at = CLOCK.perf_counter_ns()
+        self.publish(busy=False, target=self.speed)
+        self._done.set()
+        on_done, self._on_done = self._on_done, None
+        if on_done is not None:
+            on_done()
+
+    @staticmethod
+    def check_speed(speed: float):
+        """Raise on the caller's thread, a bad speed would otherwise only fail on the timer thread"""
+        if not -100 <= speed <= 100:
+            raise ValueError(f"speed {speed} is outside -100 to 100")
+
+    def set_speed(self, speed: float, on_done=None):
+        """Ramp to a new speed and keep running, the sign of speed gives the direction"""
+        self.check_speed(speed)
+        if STOP.is_set():
+            return
+        self.publish(target=speed)
+        self._play(self.plan(self.speed, speed), on_done)
+
+    def start_run(self, speed: float, run_time: float, on_done=None):
+        """
+        Run at speed for run_time seconds (from the command until the ramp down starts) and
+        ramp back to a stop, without blocking. on_done is called from the timer thread once
+        the motor has stopped.
+        """
+        self.check_speed(speed)
+        if STOP.is_set():
+            return
+        self.publish(target=speed)
+        self._play(self.plan_run(speed, run_time), on_done)
+
+    def plan_run(self, speed: float, run_time: float, start: float=None) -> list:
+        """Steps of a timed run from 'start' (default the current speed) back to a stop"""
+        up = self.plan(self.speed if start is None else start, speed)
+        return up + self.plan(speed, 0, offset=max(run_time, up[-1][0]))
+
+    def move_time(self, speed: float, run_time: float, start: float=None) -> float:
+        """Seconds move_motor takes with these arguments"""
+        return self.plan_run(speed, run_time, start)[-1][0]
+
+    def wait(self, timeout: float=None) -> bool:
+        """Block until the current timed run or ramp has finished"""
+        return self._done.wait(timeout)
+
+    @instrumented
+    def move_motor(self, speed: int, run_time: float):
+        """Timed run that blocks until the motor has stopped again, like it always has"""
+        self.start_run(speed, run_time)
+        self.wait()
+
+    async def run(self, speed: int, run_time: float):
+        """Awaitable version of move_motor. The motor is stopped if the task is cancelled"""
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+
+        def on_done():
+            loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(None))
+
+        self.start_run(speed, run_time, on_done)
+        if self._done.is_set():     # refused because of the emergency stop, or played inline
+            return
+        try:
+            await finished
+        except asyncio.CancelledError:
             self.stop_motor()
+            raise
+
+    def halt(self):
+        self.stop_motor()
+
+    def start_motor(self, speed: int):
+        """Start the motor, the sign of speed gives the direction"""
+        self.set_speed(speed)
 
     def stop_motor(self):
+        """Stop immediately, no ramp. Drops any ramp or timed run in progress"""
+        with self._lock:
+            self._generation += 1
+            self._apply(0)
+            self._finish()
+
+    def clean(self):
+        self.stop_motor()
         self.pwm1.stop()
         self.pwm2.stop()
+        Motor.forget(self.IN1, self.IN2)    # stopped PWMs leave the pins at an unknown level
+        Motor.clean(self)
 
 class Solenoid(Motor):
     def __init__(self, out_pin: int):
         super().__init__(out_pin)
         self.control_pin = out_pin
 
+    @instrumented
     def open(self):
-        GPIO.output(self.control_pin, GPIO.HIGH)
+        self.write(self.control_pin, GPIO.HIGH)
+        self.started()
+        self.publish(position=1, target=1)
 
+    @instrumented
     def close(self):
-        GPIO.output(self.control_pin, GPIO.LOW)
+        self.write(self.control_pin, GPIO.LOW)
+        self.started()
+        self.publish(position=0, target=0)
 
 class Stepper(Motor):
     """Class to define stepper motors and initialize through motors"""
@@ -150,39 +1009,165 @@ class Stepper(Motor):
         self.step_pin = step_pin
         self.dir_pin = dir_pin
         self.position = 0
+        if hasattr(GPIO, 'attach_stepper'):   # simulated backends model the stepper
+            GPIO.attach_stepper(step_pin, dir_pin)
+        self.state_key = f"Stepper:{step_pin}:{dir_pin}"
+        position = self.restore()
+        if position is not None:
+            self.position = int(position)
+            self.publish(position=self.position, target=self.position)
+        self.profile = None
+        self.last_move_stats = None
+
+    def set_profile(self, max_rate: float, accel: float, jerk: float=None, start_rate: float=START_RATE):
+        """
+        Use an acceleration profile for moves that do not pass an explicit delay.
+        See StepProfile for the units.
+        """
+        self.profile = StepProfile(max_rate, accel, jerk, start_rate)
 
-    def move_motor(self, steps: int, delay: float=0.003):
+    def clear_profile(self):
+        self.profile = None
+
+    @instrumented
+    def move_motor(self, steps: int, delay: float=None, cancel: threading.Event=None):
         """
         This method will take an input for steps as a positive or negative number
         and move the stepper in the direction indicated by the sign. The delay is also the speed
         of the motor and is set by default if no other variable is passed. This will also keep track of the
         position
+
+        If no delay is passed and a profile was set with set_profile, the move ramps up and down
+        following that profile instead of running at one constant speed.
+
+        Setting the optional 'cancel' event stops the move after the current step, position
+        then only counts the steps that were actually made. Returns the number of steps made.
         """
-        GPIO.output(self.step_pin, GPIO.HIGH)
+        # the step pin is left alone until the first step, the dir pin is only written when it changes
         if steps < 0:
-            GPIO.output(self.dir_pin, GPIO.HIGH)    #change this to low if you want to swap direction convention
-            self.position += steps
-            print("Direction is HIGH\n")
+            self.write(self.dir_pin, GPIO.HIGH)    #change this to low if you want to swap direction convention
+            direction = -1
+            log.debug("Direction is HIGH")
             steps=steps*-1  #allows direction to be read directly from step numbering
         else:
-            GPIO.output(self.dir_pin, GPIO.LOW)
-            print("Direction is LOW\n")
-            self.position += steps
-        for i in range(steps):
-            GPIO.output(self.step_pin, GPIO.HIGH)
-            time.sleep(delay)
-            GPIO.output(self.step_pin, GPIO.LOW)
-            time.sleep(delay)
+            self.write(self.dir_pin, GPIO.LOW)
+            direction = 1
+            log.debug("Direction is LOW")
+
+        # all of the timing math happens here, before the first pulse
+        periods, half_periods = compile_steps(steps, delay, self.profile)
+        self.publish(target=self.position + direction * steps,
+                     velocity=direction * len(periods) / sum(periods) if periods else 0.0)
+        self.save(moving=True)
+        done = self.pulse(periods, cancel, direction, half_periods)
+        self.position += direction * done
+        self.publish(position=self.position)
+        self.save()
 
-        print(f"New position: {self.position}")
+        log.info("Stepper %d: new position %d", self.step_pin, self.position)
+        return done
+
+    def plan_move(self, steps: int, delay: float=None):
+        """Step periods of a move of abs(steps) steps, from the profile or the constant delay"""
+        return compile_steps(abs(steps), delay, self.profile)[0]
+
+    def move_time(self, steps: int, delay: float=None, cancel: threading.Event=None) -> float:
+        """Seconds move_motor takes with these arguments, a cancel event does not change the plan"""
+        return sum(self.plan_move(steps, delay))
+
+    async def move(self, steps: int, delay: float=None):
+        """
+        Awaitable version of move_motor. The pulse train runs on the pulse driver so edge
+        timing does not depend on the event loop; cancelling the task stops the stepper
+        after the current step.
+        """
+        return await _run_on_driver(self.move_motor, steps, delay)
+
+    def pulse(self, periods, cancel: threading.Event=None, direction: int=1, half_periods=None) -> int:
+        """
+        Pulse engine for move_motor, one step per entry of 'periods' (seconds between rising
+        edges). Every edge is scheduled against an absolute perf_counter_ns deadline rather
+        than sleeping after the previous edge, so sleep overshoot and the cost of GPIO.output
+        do not add up over a move. The achieved rate and worst lateness are kept in
+        self.last_move_stats. The position is published every STATE_PUBLISH_STEPS steps,
+        'direction' tells it which way to count. Returns the number of steps made before
+        'cancel' or the emergency stop was set.
+        """
+        # the edges are written straight to the backend, so the shadow of the step pin is
+        # unknown until the loop has finished; if it never does, clean() writes the pin for real
+        Motor.forget(self.step_pin)
+        with self.motion():
+            pulse_train = getattr(GPIO, 'pulse_train', None)
+            if pulse_train is not None:
+                # the backend times the whole train in hardware, nothing for us to schedule.
+                # None means the other stepper has its wave engine, then we time this one here
+                start = CLOCK.perf_counter_ns()
+                self.started()
+                steps = pulse_train(self.step_pin, periods, _AnyEvent(STOP, cancel))
+                if steps is not None:
+                    return self._report(periods, steps, CLOCK.perf_counter_ns() - start, 0)
+
+            if half_periods is None:
+                half_periods = array('q', [int(p * 5e8) for p in periods])    # ns, HIGH and LOW are equal halves
+            steps = len(half_periods)
+            max_late = 0
+            start = CLOCK.perf_counter_ns()
+            deadline = start
+            for i in range(steps):
+                late = wait_until(deadline)
+                # checked right before every step, a started pulse is always finished
+                if STOP.is_set() or (cancel is not None and cancel.is_set()):
+                    steps = i
+                    break
+                if not i % STATE_PUBLISH_STEPS:
+                    self.publish(position=self.position + direction * i)
+                GPIO.output(self.step_pin, GPIO.HIGH)
+                if not i:
+                    self.started()
+                if late > max_late:
+                    max_late = late
+                deadline += half_periods[i]
+                late = wait_until(deadline)
+                GPIO.output(self.step_pin, GPIO.LOW)
+                if late > max_late:
+                    max_late = late
+                deadline += half_periods[i]
+            wait_until(deadline)    # hold the last LOW for a full half period like the old loop did
+            if steps:
+                Motor.levels[self.step_pin] = GPIO.LOW     # the loop always ends on a LOW edge
+            return self._report(periods, steps, CLOCK.perf_counter_ns() - start, max_late)
+
+    def halt(self):
+        """Drive the pins LOW and stop a hardware pulse train that is already playing"""
+        halt_waves = getattr(GPIO, 'halt_waves', None)
+        if halt_waves is not None and self.busy:
+            halt_waves(self.step_pin)
+        Motor.halt(self)
+
+    def _report(self, periods: array, steps: int, elapsed: int, max_late: int) -> int:
+        """Store and print the stats of a pulse train, returns steps for convenience"""
+        planned = sum(periods[:steps])
+        requested_rate = steps / planned if planned > 0 else float('inf')
+        achieved_rate = steps / (elapsed / 1e9) if elapsed > 0 else 0.0
+        self.last_move_stats = {
+            'steps': steps,
+            'requested_rate': requested_rate,   # steps/s, averaged over the whole move
+            'achieved_rate': achieved_rate,     # steps/s
+            'max_lateness_us': max_late / 1e3,
+        }
+        log.debug("Achieved %.1f of %.1f steps/s, max lateness %.1f us",
+                  achieved_rate, requested_rate, max_late / 1e3)
+        return steps
 
 class SmallServo(ServoMotor):
+    HOME = 15
 
-    def __init__(self, pwm_pin: int):
-        super().__init__(pwm_pin)
+    def __init__(self, pwm_pin: int, calibration: ServoCalibration=None):
+        super().__init__(pwm_pin, calibration or SMALL_CALIBRATION)
         self.pwm_pin = pwm_pin
-        self.position = 15
-        self.change_pos(15)
+        self.slew_rate = SMALL_SLEW_RATE
+        if self.position != self.HOME:
+            self.change_pos(self.HOME)      # restored somewhere else, the PWM already starts at HOME otherwise
 
     def open_close(self):
         if self.position == 10:
@@ -192,29 +1177,189 @@ class SmallServo(ServoMotor):
             self.change_pos(10)
             self.position = 10
 
-    def change_pos(self, position: int):
-        """Method to change the position of as servo"""
-        current_pos = self.position
-        new_pos = position
-        difference = new_pos - current_pos
-        if difference < 0:
-            for i in range(abs(difference)):
-                self.step_up(current_pos-i)
-                time.sleep(0.3)
-                self.position = current_pos-i
-        if difference > 0:
-            for i in range(abs(difference)):
-                self.step_up(current_pos+i)
-                time.sleep(0.3)
-                self.position = current_pos+i
-
-    def step_up(self, position):
-        # state = servo_setting(position)
-        Pulse_width = SMALL_MIN + (position / 100) * (SMALL_MAX - SMALL_MIN)
-        state = Pulse_width * SMALL_FREQ * 100
-        # print(state)
-        self.pwm.ChangeDutyCycle(state)
-        time.sleep(0.1)
     def clean(self):
         self.pwm.stop()
         GPIO.cleanup(self.pwm_pin)
+        Motor.forget(self.pwm_pin)
+
+class StepperGroup:
+    """
+    Moves several steppers together from a single timing loop.
+
+    The axis with the most steps sets the pace, the other axes are spread over its ticks with
+    DDA (Bresenham) interpolation so every axis starts and finishes together. Pins that
+    change on the same tick are written with one batched GPIO.output call.
+    """
+
+    def __init__(self, *steppers: Stepper):
+        if not steppers:
+            raise ValueError("a StepperGroup needs at least one Stepper")
+        self.steppers = steppers
+        self.profile = None
+        self.last_move_stats = None
+
+    def set_profile(self, max_rate: float, accel: float, jerk: float=None, start_rate: float=START_RATE):
+        """Acceleration profile for the leading axis, see StepProfile"""
+        self.profile = StepProfile(max_rate, accel, jerk, start_rate)
+
+    def move_motor(self, steps: list, delay: float=None, cancel: threading.Event=None) -> list:
+        """
+        Move every stepper by its entry in 'steps' (same order as the constructor, signs give
+        the direction). delay and profile behave like Stepper.move_motor and apply to the axis
+        with the most steps. Returns the steps made per axis.
+        """
+        if len(steps) != len(self.steppers):
+            raise ValueError(f"expected {len(self.steppers)} step counts, got {len(steps)}")
+        counts = [abs(n) for n in steps]
+        major = max(counts)
+
+        # directions for all axes in one write, leaving out the ones that do not change
+        Motor.write([s.dir_pin for s in self.steppers], [GPIO.HIGH if n < 0 else GPIO.LOW for n in steps])
+
+        patterns, ticks = self.compile_ticks(counts)
+        periods, half_periods = compile_steps(major, delay, self.profile)
+
+        for stepper, n in zip(self.steppers, steps):
+            stepper.publish(target=stepper.position + n)
+            stepper.save(moving=True)
+
+        max_late = 0
+        done = major
+        Motor.forget(*(s.step_pin for s in self.steppers))    # see Stepper.pulse
+        with ExitStack() as stack:
+            for stepper in self.steppers:
+                stack.enter_context(stepper.motion())
+            start = CLOCK.perf_counter_ns()
+            deadline = start
+            for i in range(major):
+                pins = patterns[ticks[i]]
+                late = wait_until(deadline)
+                if STOP.is_set() or (cancel is not None and cancel.is_set()):
+                    done = i
+                    break
+                if pins:
+                    GPIO.output(pins, GPIO.HIGH)
+                if late > max_late:
+                    max_late = late
+                deadline += half_periods[i]
+                late = wait_until(deadline)
+                if pins:
+                    GPIO.output(pins, GPIO.LOW)
+                if late > max_late:
+                    max_late = late
+                deadline += half_periods[i]
+            wait_until(deadline)
+            elapsed = CLOCK.perf_counter_ns() - start
+            if done:
+                for stepper in self.steppers:
+                    Motor.levels[stepper.step_pin] = GPIO.LOW    # every tick ends on a LOW edge
+
+        made = []
+        for stepper, n, count in zip(self.steppers, steps, counts):
+            moved = (done * count + major // 2) // major if major else 0
+            stepper.position += moved if n >= 0 else -moved
+            stepper.publish(position=stepper.position)
+            stepper.save()
+            made.append(moved)
+
+        self.last_move_stats = {
+            'ticks': done,
+            'steps': made,
+            'achieved_rate': done / (elapsed / 1e9) if elapsed > 0 else 0.0,   # ticks/s of the leading axis
+            'max_lateness_us': max_late / 1e3,
+        }
+        log.info("New positions: %s", [s.position for s in self.steppers])
+        return made
+
+    def compile_ticks(self, counts: list) -> tuple:
+        """
+        Which step pins fire on every tick, an axis with n steps fires whenever round(t*n/major)
+        goes up. Returns (pin lists, pattern index per tick), cached in 'trajectories'.
+        """
+        pins = tuple(s.step_pin for s in self.steppers)
+
+        def build():
+            major = max(counts)
+            patterns = {}
+            ticks = array('H')
+            for t in range(major):
+                fired = tuple(pin for pin, n in zip(pins, counts)
+                              if (((t + 1) * n + major // 2) // major) > ((t * n + major // 2) // major))
+                ticks.append(patterns.setdefault(fired, len(patterns)))
+            return tuple(list(p) for p in patterns), _frozen(ticks)
+
+        return trajectories.get(('ticks', pins, tuple(counts)), build)
+
+    async def move(self, steps: list, delay: float=None):
+        """Awaitable version of move_motor, runs on the pulse driver like Stepper.move"""
+        return await _run_on_driver(self.move_motor, steps, delay)
+
+
+class LazyActuator:
+    """
+    Stands in for an actuator until it is needed. Nothing touches the hardware until the
+    first attribute that only the real actuator has is used, or arm() is called; then the
+    actuator is built exactly once. clean() on an actuator that was never built does nothing.
+    'name' replaces the actuator's default name (e.g. 'Stepper:11') that its metrics are filed under.
+    """
+
+    def __init__(self, cls, *args, name: str=None, **kwargs):
+        self._cls = cls
+        self._args = args
+        self._kwargs = kwargs
+        self._name = name
+        self._actuator = None
+        self._lock = threading.Lock()
+        self.init_time = None   # seconds the constructor took
+
+    @property
+    def built(self) -> bool:
+        return self._actuator is not None
+
+    def build(self) -> Motor:
+        with self._lock:
+            if self._actuator is None:
+                start = time.perf_counter()
+                actuator = self._cls(*self._args, **self._kwargs)
+                self.init_time = time.perf_counter() - start
+                if self._name:
+                    actuator.name = self._name
+                self._actuator = actuator
+        return self._actuator
+
+    @property
+    def state(self) -> ActuatorState:
+        return self._actuator.state if self._actuator is not None else ActuatorState()
+
+    def clean(self):
+        if self._actuator is not None:
+            self._actuator.clean()
+
+    def __getattr__(self, name):
+        return getattr(self.build(), name)
+
+    def __repr__(self):
+        return f"LazyActuator({self._cls.__name__}{self._args}, built={self.built})"
+
+
+def arm(actuators: dict, max_workers: int=None) -> dict:
+    """
+    Build every LazyActuator in {name: actuator} at the same time, the servos' start up moves
+    and PWM set up overlap instead of adding up. Returns {name: seconds}, None for actuators
+    that failed to build (the error is logged).
+    """
+    lazy = {name: a for name, a in actuators.items() if isinstance(a, LazyActuator)}
+    times = {}
+    if not lazy:
+        return times
+    setup_gpio()
+    with ThreadPoolExecutor(max_workers=max_workers or len(lazy), thread_name_prefix='arm') as pool:
+        futures = {name: pool.submit(actuator.build) for name, actuator in lazy.items()}
+        for name, future in futures.items():
+            try:
+                future.result()
+                times[name] = lazy[name].init_time
+            except Exception as e:
+                log.error("%s could not be set up: %s", name, e)
+                times[name] = None
+    return times
@@ -0,0 +1,217 @@
+"""
+This script runs assembly sequences that are written down as data instead of straight-line code.
+
+A sequence is a list of operations on named actuators (LEFT_TRAY, LEFT_ELEVATOR, LEAD_SCREW, ...).
+Every operation can list the operations it has to wait for ('after') and extra resources it
+needs to itself ('locks', e.g. 'left_arm' when two actuators must not move at the same time).
+Every operation also locks its own actuator, so one actuator never gets two commands at once.
+run() then starts every operation as soon as its dependencies are done and its locks are free,
+so independent steps like the left tray, the right elevator and the lead screw overlap.
+
+Sequences can be built in Python
+
+    seq = Sequence('left node')
+    seq.add('feed', 'LEFT_TRAY', 'move_motor', 50, 2)
+    seq.add('raise', 'LEFT_ELEVATOR', 'change_pos', 80, after=['feed'], locks=['left_arm'])
+
+or loaded from a JSON (or YAML, if PyYAML is installed) file, see Examples/node_beam_cycle.json.
+A file can also list the actuators to build, then it can be run directly:
+
+    python Sequence.py Examples/node_beam_cycle.json
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+import json
+import logging
+import time
+
+log = logging.getLogger('cosmic.sequence')
+
+
+class SequenceError(Exception):
+    """The sequence is malformed or one of its operations failed"""
+
+
+class Operation:
+    """One call on an actuator, e.g. LEFT_TRAY.move_motor(50, 2)"""
+
+    def __init__(self, name: str, actuator: str, call: str, args: tuple=(), after: list=(), locks: list=()):
+        self.name = name
+        self.actuator = actuator
+        self.call = call
+        self.args = tuple(args)
+        self.after = list(after)
+        self.locks = {actuator, *locks}     # the actuator itself is always locked
+
+    def __repr__(self):
+        return f"{self.name}: {self.actuator}.{self.call}{self.args}"
+
+
+class Sequence:
+    """A set of operations with their dependencies, see the module docstring"""
+
+    def __init__(self, name: str='sequence', actuators: dict=None):
+        self.name = name
+        self.operations = {}
+        self.actuators = actuators or {}    # name -> [MotorClass class name, pins] for files that build their own
+
+    def add(self, name: str, actuator: str, call: str, *args, after: list=(), locks: list=()) -> Operation:
+        if name in self.operations:
+            raise SequenceError(f"operation '{name}' is defined twice")
+        operation = Operation(name, actuator, call, args, after, locks)
+        self.operations[name] = operation
+        return operation
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Sequence':
+        sequence = cls(data.get('name', 'sequence'), data.get('actuators'))
+        for op in data['operations']:
+            sequence.add(op['name'], op['actuator'], op['call'], *op.get('args', ()),
+                         after=op.get('after', ()), locks=op.get('locks', ()))
+        return sequence
+
+    def to_dict(self) -> dict:
+        """The inverse of from_dict, operations stay in their current order"""
+        operations = []
+        for op in self.operations.values():
+            entry = {'name': op.name, 'actuator': op.actuator, 'call': op.call, 'args': list(op.args)}
+            if op.after:
+                entry['after'] = op.after
+            if op.locks - {op.actuator}:
+                entry['locks'] = sorted(op.locks - {op.actuator})
+            operations.append(entry)
+        return {'name': self.name, 'actuators': self.actuators, 'operations': operations}
+
+    @classmethod
+    def load(cls, path: str) -> 'Sequence':
+        """Read a sequence from a .json file, or .yaml/.yml if PyYAML is available"""
+        with open(path) as f:
+            if path.endswith(('.yaml', '.yml')):
+                try:
+                    import yaml
+                except ImportError:
+                    raise SequenceError("PyYAML is needed for YAML sequences, use JSON instead")
+                data = yaml.safe_load(f)
+            else:
+                data = json.load(f)
+        return cls.from_dict(data)
+
+    def order(self) -> list:
+        """Operations in an order that respects every dependency, raises on unknown names or cycles"""
+        for op in self.operations.values():
+            for dep in op.after:
+                if dep not in self.operations:
+                    raise SequenceError(f"'{op.name}' waits for unknown operation '{dep}'")
+        ordered = []
+        state = {}      # name -> 'visiting' or 'done'
+
+        def visit(op, path):
+            if state.get(op.name) == 'done':
+                return
+            if state.get(op.name) == 'visiting':
+                raise SequenceError(f"dependency cycle: {' -> '.join(path + [op.name])}")
+            state[op.name] = 'visiting'
+            for dep in op.after:
+                visit(self.operations[dep], path + [op.name])
+            state[op.name] = 'done'
+            ordered.append(op)
+
+        for op in self.operations.values():
+            visit(op, [])
+        return ordered
+
+    def validate(self, actuators: dict):
+        """Check the dependencies and that every operation can be called on the given actuators"""
+        for op in self.order():
+            if op.actuator not in actuators:
+                raise SequenceError(f"'{op.name}' uses unknown actuator '{op.actuator}'")
+            if not callable(getattr(actuators[op.actuator], op.call, None)):
+                raise SequenceError(f"'{op.name}': {op.actuator} has no method '{op.call}'")
+
+    def build_actuators(self) -> dict:
+        """Create the actuators listed in the sequence file, set up in parallel"""
+        import MotorClass
+
+        actuators = {}
+        for name, (kind, pins) in self.actuators.items():
+            pins = pins if isinstance(pins, list) else [pins]
+            actuators[name] = MotorClass.LazyActuator(getattr(MotorClass, kind), *pins, name=name)
+        MotorClass.arm(actuators)   # set them all up at once
+        return actuators
+
+
+def run(sequence: Sequence, actuators: dict, max_parallel: int=None) -> dict:
+    """
+    Run the sequence on the actuators (name -> MotorClass object), overlapping everything the
+    dependencies and locks allow. Ready operations start in the order they were defined.
+
+    Returns {operation name: (start, end)} in seconds from the start of the run. If an
+    operation fails no new ones are started, the running ones finish and SequenceError is
+    raised. The emergency stop is left to MotorClass, it ends every running move.
+    """
+    sequence.validate(actuators)
+    pending = list(sequence.operations.values())
+    done = set()
+    held = set()
+    running = {}    # future -> operation
+    times = {}
+    failure = None
+    start = time.monotonic()
+
+    def call(op):
+        began = time.monotonic() - start
+        log.info("%s: %s.%s%s", op.name, op.actuator, op.call, op.args)
+        getattr(actuators[op.actuator], op.call)(*op.args)
+        return began, time.monotonic() - start
+
+    with ThreadPoolExecutor(max_workers=max_parallel or max(1, len(pending)),
+                            thread_name_prefix='sequence') as pool:
+        while pending or running:
+            if failure is None:
+                for op in list(pending):
+                    if max_parallel and len(running) >= max_parallel:
+                        break
+                    if all(dep in done for dep in op.after) and not op.locks & held:
+                        held |= op.locks
+                        running[pool.submit(call, op)] = op
+                        pending.remove(op)
+            if not running:
+                break   # nothing left that can start, only happens after a failure
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                op = running.pop(future)
+                held -= op.locks
+                try:
+                    times[op.name] = future.result()
+                    done.add(op.name)
+                except Exception as e:
+                    log.error("%s failed: %s", op.name, e)
+                    failure = failure or SequenceError(f"operation '{op.name}' failed: {e}")
+
+    if failure is not None:
+        raise failure
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an assembly sequence file")
+    parser.add_argument('sequence', help="JSON or YAML sequence file that lists its actuators")
+    parser.add_argument('--max-parallel', type=int, help="most operations running at once")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    sequence = Sequence.load(args.sequence)
+    actuators = sequence.build_actuators()
+    try:
+        times = run(sequence, actuators, args.max_parallel)
+        total = max(end for began, end in times.values()) if times else 0.0
+        serial = sum(end - began for began, end in times.values())
+        print(f"{sequence.name}: {len(times)} operations in {total:.2f} s ({serial:.2f} s one at a time)")
+    finally:
+        for actuator in actuators.values():
+            actuator.clean()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+This script keeps actuator positions in a small memory mapped file so a restart does not need
+re-homing.
+
+The file has a fixed layout: a header and one record per actuator. Every record holds the
+actuator key (e.g. 'Stepper:11:13') and two copies of its state, each with a sequence number
+and a CRC32. A write always goes to the older copy, so a crash in the middle of a write
+leaves the other copy intact. Writes land in the page cache, which survives the process
+crashing; the file is only flushed to disk (msync) every FLUSH_INTERVAL seconds and on close.
+
+An actuator writes MOVING before a move and its final position after it. If the process dies
+in between, the record still says MOVING and the position is not restored.
+"""
+
+from typing import Final
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+STATE_FILE_ENV: Final[str] = 'COSMIC_STATE_FILE'
+DEFAULT_STATE_FILE: Final[str] = os.path.join(os.path.expanduser('~'), '.cosmic', 'actuator_state.bin')
+HARDWARE_BACKENDS: Final[tuple] = ('rpi', 'pigpio')     # simulated rigs start from zero unless a file is given
+
+MAGIC: Final[bytes] = b'COSMSTAT'
+VERSION: Final[int] = 1
+SLOTS: Final[int] = 64                  # actuators the file has room for
+FLUSH_INTERVAL: Final[float] = 1.0      # seconds between msyncs
+
+HEADER = struct.Struct('<8sII')         # magic, version, slots
+HEADER_SIZE: Final[int] = 64
+KEY_SIZE: Final[int] = 32
+COPY = struct.Struct('<QddII')          # seq, position, target, flags, crc
+RECORD_SIZE: Final[int] = KEY_SIZE + 2 * COPY.size
+
+log = logging.getLogger('cosmic.state')
+
+IDLE: Final[int] = 0
+MOVING: Final[int] = 1
+
+
+class StateStore:
+    """Checksummed, double buffered actuator records in a memory mapped file"""
+
+    def __init__(self, path: str, slots: int=SLOTS):
+        self.path = path
+        self.slots = slots
+        size = HEADER_SIZE + slots * RECORD_SIZE
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fresh = os.fstat(fd).st_size != size
+            if fresh:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        if fresh or HEADER.unpack_from(self.map, 0) != (MAGIC, VERSION, slots):
+            # missing, truncated or another layout, nothing in it can be trusted
+            self.map[:] = bytes(size)
+            HEADER.pack_into(self.map, 0, MAGIC, VERSION, slots)
+        self.index = {}
+        for slot in range(slots):
+            key = self._key(slot)
+            if key:
+                self.index[key] = slot
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def _key(self, slot: int) -> str:
+        offset = HEADER_SIZE + slot * RECORD_SIZE
+        return bytes(self.map[offset:offset + KEY_SIZE]).rstrip(b'\0').decode('ascii', 'replace')
+
+    def _copies(self, slot: int) -> list:
+        """Both copies of a slot as (offset, seq, position, target, flags, valid)"""
+        copies = []
+        for i in range(2):
+            offset = HEADER_SIZE + slot * RECORD_SIZE + KEY_SIZE + i * COPY.size
+            seq, position, target, flags, crc = COPY.unpack_from(self.map, offset)
+            valid = seq > 0 and crc == zlib.crc32(self.map[offset:offset + COPY.size - 4])
+            copies.append((offset, seq, position, target, flags, valid))
+        return copies
+
+    def write(self, key: str, position: float, target: float, flags: int=IDLE):
+        """Store the state of an actuator, allocating a record the first time a key is seen"""
+        with self._lock:
+            slot = self.index.get(key)
+            if slot is None:
+                if len(self.index) >= self.slots:
+                    raise RuntimeError(f"state file {self.path} has no free records")
+                slot = len(self.index)
+                offset = HEADER_SIZE + slot * RECORD_SIZE
+                self.map[offset:offset + KEY_SIZE] = key.encode('ascii')[:KEY_SIZE].ljust(KEY_SIZE, b'\0')
+                self.index[key] = slot
+            copies = self._copies(slot)
+            newest = max((c[1] for c in copies if c[-1]), default=0)
+            # overwrite the invalid copy, or the older of two valid ones
+            offset = min(copies, key=lambda c: (c[-1], c[1]))[0]
+            COPY.pack_into(self.map, offset, newest + 1, position, target, flags, 0)
+            crc = zlib.crc32(self.map[offset:offset + COPY.size - 4])
+            struct.pack_into('<I', self.map, offset + COPY.size - 4, crc)
+            if time.monotonic() - self._last_flush > FLUSH_INTERVAL:
+                self.flush()
+
+    def read(self, key: str):
+        """(position, target, flags) of the newest valid copy, None if there is none"""
+        with self._lock:
+            slot = self.index.get(key)
+            if slot is None:
+                return None
+            valid = [c for c in self._copies(slot) if c[-1]]
+        if not valid:
+            return None
+        offset, seq, position, target, flags, ok = max(valid, key=lambda c: c[1])
+        return position, target, flags
+
+    def flush(self):
+        self.map.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.map.close()
+
+
+def default(backend: str):
+    """
+    The store the motor classes use: COSMIC_STATE_FILE if set, otherwise the default file on
+    hardware backends and none at all on simulated ones.
+    """
+    path = os.environ.get(STATE_FILE_ENV)
+    if path is None and backend in HARDWARE_BACKENDS:
+        path = DEFAULT_STATE_FILE
+    if not path:
+        return None
+    try:
+        return StateStore(path)
+    except OSError as e:
+        log.warning("Actuator state will not be kept, %s: %s", path, e)
+        return None
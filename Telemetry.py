@@ -0,0 +1,81 @@
+"""
+This script carries log and telemetry messages from the motor code to the GUI.
+
+Producers (worker threads, the motion loops, the GUI itself) use the standard logging module
+under the 'cosmic' logger. TelemetryHandler drops each record into a bounded ring buffer, which
+is cheap and never blocks the producer. The GUI drains the buffer on a timer and inserts the
+whole batch at once, so a burst of messages costs one widget update instead of one per line.
+When the buffer is full the oldest entries are dropped and counted.
+"""
+
+from collections import deque
+from typing import Final
+import logging
+import threading
+
+LOGGER_NAME: Final[str] = 'cosmic'
+BUFFER_SIZE: Final[int] = 10000     # entries kept between two drains before the oldest are dropped
+
+LEVELS: Final[dict] = {
+    'DEBUG': logging.DEBUG,
+    'INFO': logging.INFO,
+    'WARNING': logging.WARNING,
+    'ERROR': logging.ERROR,
+}
+
+
+class TelemetryBuffer:
+    """Thread safe ring buffer of (time, level, source, message) entries"""
+
+    def __init__(self, size: int=BUFFER_SIZE):
+        self.entries = deque(maxlen=size)
+        self.dropped = 0        # entries overwritten before anyone drained them
+        self._lock = threading.Lock()
+
+    def push(self, created: float, level: int, source: str, message: str):
+        with self._lock:
+            if len(self.entries) == self.entries.maxlen:
+                self.dropped += 1
+            self.entries.append((created, level, source, message))
+
+    def drain(self, limit: int=None) -> list:
+        """Take up to 'limit' of the oldest entries, everything if limit is None"""
+        with self._lock:
+            if limit is None or limit >= len(self.entries):
+                batch = list(self.entries)
+                self.entries.clear()
+            else:
+                batch = [self.entries.popleft() for i in range(limit)]
+        return batch
+
+
+class TelemetryHandler(logging.Handler):
+    """logging handler that only formats the message and pushes it into a TelemetryBuffer"""
+
+    def __init__(self, buffer: TelemetryBuffer, level: int=logging.INFO):
+        super().__init__(level)
+        self.buffer = buffer
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.buffer.push(record.created, record.levelno, record.name, record.getMessage())
+        except Exception:
+            self.handleError(record)
+
+
+def install(buffer: TelemetryBuffer, level: int=logging.INFO) -> TelemetryHandler:
+    """
+    Send everything logged under 'cosmic' at 'level' or above into 'buffer'. Raising the level
+    later with handler.setLevel() also makes the loggers skip the records entirely.
+    """
+    handler = TelemetryHandler(buffer, level)
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    return handler
+
+
+def set_level(handler: TelemetryHandler, level: int):
+    """Change the level of the handler and the 'cosmic' logger together"""
+    handler.setLevel(level)
+    logging.getLogger(LOGGER_NAME).setLevel(level)
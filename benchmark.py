@@ -0,0 +1,267 @@
+"""
+This script benchmarks the motion code so we have real numbers for step rate, jitter and
+servo settle time, and can tell whether a change made things faster or slower.
+
+It runs a fixed set of scenarios on whichever GPIO backend is selected and writes the results
+as JSON:
+    stepper     - long stepper moves at several delays
+    servo       - full range sweeps of a ServoMotor and a SmallServo
+    dc          - DC motor start/stop cycles
+    concurrent  - both steppers stepping while the other actuators get GUI style commands
+
+Edges are timestamped by wrapping the backend's output() so every backend can be measured.
+
+    python benchmark.py --backend virtual --output bench.json
+    python benchmark.py --backend rpi --scenarios stepper servo
+"""
+
+import argparse
+import json
+import time
+
+import GPIOBackend
+
+STEP_DELAYS = [0.003, 0.001, 0.0005, 0.0002]    # seconds, half period like Stepper.move_motor
+JITTER_BUCKETS_US = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# pins for the benchmark actuators, the same as the GUI so it can run on the rig
+STEPPER_PINS = [(11, 13), (33, 35)]
+SERVO_PIN = 16
+SMALL_SERVO_PIN = 15
+DC_PINS = (29, 31)
+
+
+class EdgeRecorder:
+    """Wraps a GPIO backend and timestamps every output() call with MotorClass.CLOCK"""
+
+    def __init__(self, backend, clock):
+        self.backend = backend
+        self.clock = clock
+        self.edges = []
+
+    def output(self, channel, value):
+        self.backend.output(channel, value)
+        t = self.clock.perf_counter_ns()
+        if isinstance(channel, (list, tuple)):
+            values = value if isinstance(value, (list, tuple)) else [value] * len(channel)
+            self.edges.extend((t, pin, level) for pin, level in zip(channel, values))
+        else:
+            self.edges.append((t, channel, value))
+
+    def rising_edges(self, pin: int) -> list:
+        """Times the pin actually went LOW -> HIGH, repeated HIGH writes are not edges"""
+        times = []
+        previous = None
+        for t, p, level in self.edges:
+            if p == pin:
+                if level and not previous:
+                    times.append(t)
+                previous = level
+        return times
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def jitter_stats(edges: list, period_ns: float) -> dict:
+    """Histogram and summary of how far each rising edge interval was off the requested period"""
+    errors = [abs((b - a) - period_ns) / 1e3 for a, b in zip(edges, edges[1:])]
+    histogram = {f"<={edge}us": 0 for edge in JITTER_BUCKETS_US}
+    histogram['more'] = 0
+    for error in errors:
+        for edge in JITTER_BUCKETS_US:
+            if error <= edge:
+                histogram[f"<={edge}us"] += 1
+                break
+        else:
+            histogram['more'] += 1
+    return {
+        'intervals': len(errors),
+        'mean_us': sum(errors) / len(errors) if errors else None,
+        'p50_us': percentile(errors, 0.5),
+        'p99_us': percentile(errors, 0.99),
+        'max_us': max(errors) if errors else None,
+        'histogram': histogram,
+    }
+
+
+class Timer:
+    """Measures wall, clock (simulated or real) and CPU time of a block"""
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.sim = self.clock.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.wall
+        self.cpu = time.process_time() - self.cpu
+        self.sim = (self.clock.perf_counter_ns() - self.sim) / 1e9
+
+    def result(self) -> dict:
+        return {
+            'wall_s': self.wall,
+            'clock_s': self.sim,
+            'cpu_s': self.cpu,
+            'cpu_percent': 100 * self.cpu / self.wall if self.wall > 0 else None,
+        }
+
+
+def bench_stepper(mc, recorder, steps: int) -> list:
+    stepper = mc.Stepper(*STEPPER_PINS[0])
+    results = []
+    for delay in STEP_DELAYS:
+        recorder.edges.clear()
+        with Timer(mc.CLOCK) as t:
+            stepper.move_motor(steps, delay)
+        stats = stepper.last_move_stats
+        result = {
+            'steps': steps,
+            'delay_s': delay,
+            'requested_rate': stats['requested_rate'],
+            'achieved_rate': stats['achieved_rate'],
+            'max_lateness_us': stats['max_lateness_us'],
+            'overhead_per_step_us': (t.sim - steps * 2 * delay) / steps * 1e6,
+            'jitter': jitter_stats(recorder.rising_edges(stepper.step_pin), 2 * delay * 1e9),
+        }
+        result.update(t.result())
+        results.append(result)
+    return results
+
+
+def bench_servo(mc) -> list:
+    results = []
+    for cls, pin in ((mc.ServoMotor, SERVO_PIN), (mc.SmallServo, SMALL_SERVO_PIN)):
+        servo = cls(pin)
+        servo.change_pos(0, direct=True)
+        for target in (100, 0):
+            start = servo.position
+            with Timer(mc.CLOCK) as t:
+                servo.change_pos(target)
+            planned = abs(target - start) / servo.slew_rate
+            result = {
+                'servo': cls.__name__,
+                'from': start,
+                'to': target,
+                'planned_s': planned,
+                'overrun_s': t.sim - planned,
+            }
+            result.update(t.result())
+            results.append(result)
+        servo.clean()
+    return results
+
+
+def bench_dc(mc, cycles: int) -> dict:
+    motor = mc.DCMotor(*DC_PINS)
+    run_time = 0.01
+    overheads = []
+    with Timer(mc.CLOCK) as total:
+        for i in range(cycles):
+            speed = 50 if i % 2 else -50
+            start = mc.CLOCK.perf_counter_ns()
+            motor.move_motor(speed, run_time)
+            overheads.append((mc.CLOCK.perf_counter_ns() - start) / 1e3 - run_time * 1e6)
+    motor.stop_motor()
+    result = {
+        'cycles': cycles,
+        'run_time_s': run_time,
+        'overhead_mean_us': sum(overheads) / len(overheads),
+        'overhead_p99_us': percentile(overheads, 0.99),
+        'overhead_max_us': max(overheads),
+    }
+    result.update(total.result())
+    return result
+
+
+def bench_concurrent(mc, recorder, steps: int) -> dict:
+    """Both steppers through their own workers while servo and DC commands keep arriving"""
+    from CommandQueue import ActuatorWorker
+
+    left, right = (mc.Stepper(*pins) for pins in STEPPER_PINS)
+    servo = mc.ServoMotor(SERVO_PIN)
+    dc = mc.DCMotor(*DC_PINS)
+    workers = {name: ActuatorWorker(name) for name in ('left', 'right', 'servo', 'dc')}
+    delay = 0.001
+    recorder.edges.clear()
+    with Timer(mc.CLOCK) as t:
+        workers['left'].submit(left.move_motor, steps, delay)
+        workers['right'].submit(right.move_motor, -steps, delay)
+        for i in range(10):
+            workers['servo'].submit(servo.change_pos, 100 if i % 2 else 0, merge_key='position')
+            workers['dc'].submit(dc.move_motor, 50, 0.01)
+            time.sleep(0.005)
+        while any(w.busy or w.depth for w in workers.values()):
+            time.sleep(0.01)
+    for worker in workers.values():
+        worker.stop()
+    result = {
+        'steps': steps,
+        'delay_s': delay,
+        'left': dict(left.last_move_stats, jitter=jitter_stats(recorder.rising_edges(left.step_pin), 2 * delay * 1e9)),
+        'right': dict(right.last_move_stats, jitter=jitter_stats(recorder.rising_edges(right.step_pin), 2 * delay * 1e9)),
+        'servo_last_wait_s': workers['servo'].last_wait,
+        'dc_last_wait_s': workers['dc'].last_wait,
+    }
+    result.update(t.result())
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the motion code")
+    parser.add_argument('--backend', help="GPIO backend, defaults to COSMIC_GPIO_BACKEND or rpi")
+    parser.add_argument('--scenarios', nargs='*', default=['stepper', 'servo', 'dc', 'concurrent'])
+    parser.add_argument('--steps', type=int, default=10000, help="steps per stepper move")
+    parser.add_argument('--cycles', type=int, default=100, help="DC start/stop cycles")
+    parser.add_argument('--output', help="JSON file to write, prints to stdout otherwise")
+    args = parser.parse_args()
+
+    if args.backend:
+        GPIOBackend.select(args.backend)
+    import MotorClass as mc
+
+    recorder = EdgeRecorder(mc.GPIO, mc.CLOCK)
+    mc.GPIO = recorder
+
+    results = {
+        'backend': GPIOBackend.backend_name(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scenarios': {},
+    }
+    try:
+        for scenario in args.scenarios:
+            if scenario == 'stepper':
+                results['scenarios']['stepper'] = bench_stepper(mc, recorder, args.steps)
+            elif scenario == 'servo':
+                results['scenarios']['servo'] = bench_servo(mc)
+            elif scenario == 'dc':
+                results['scenarios']['dc'] = bench_dc(mc, args.cycles)
+            elif scenario == 'concurrent':
+                results['scenarios']['concurrent'] = bench_concurrent(mc, recorder, args.steps)
+            else:
+                parser.error(f"unknown scenario '{scenario}'")
+    finally:
+        recorder.cleanup()
+    results['trajectory_cache'] = mc.trajectories.stats()
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
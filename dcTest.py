@@ -1,5 +1,5 @@
 import MotorClass
-import RPi.GPIO as GPIO
+from MotorClass import GPIO
 import time
 
 def main():
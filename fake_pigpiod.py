@@ -0,0 +1,237 @@
+"""
+This script is a stand-in for the pigpiod daemon, so the pigpio backend can be run and checked
+on a computer without a Pi.
+
+It speaks the same socket protocol and keeps one wave engine for all of its clients like the
+real daemon: WVNEW/WVAG/WVCRE build a wave, WVTXM plays it (sync mode queues it behind the one
+on air), WVTAT/WVBSY report what is playing and WVHLT/WVCLR/WVDEL stop or delete waves. Waves
+play out on the real clock. Every rising edge that went out is counted per gpio, from waves and
+from plain writes, so what a move reports can be compared with what the "hardware" did. Every
+other command just succeeds.
+
+    python fake_pigpiod.py --port 8888
+    PIGPIO_PORT=8888 COSMIC_GPIO_BACKEND=pigpio python benchmark.py --scenarios stepper
+
+--check runs both steppers at once through MotorClass and compares the steps every move
+reported with the edges that were played.
+"""
+
+from collections import Counter
+import argparse
+import os
+import socket
+import struct
+import threading
+import time
+
+CMD_WRITE = 4
+CMD_BC1 = 12
+CMD_BS1 = 14
+CMD_WVCLR = 27
+CMD_WVAG = 28
+CMD_WVBSY = 32
+CMD_WVHLT = 33
+CMD_WVCRE = 49
+CMD_WVDEL = 50
+CMD_WVNEW = 53
+CMD_WVTXM = 100
+CMD_WVTAT = 101
+
+PI_BAD_WAVE_ID = -66
+PI_EMPTY_WAVEFORM = -69
+NO_TX_WAVE = 9999
+
+COMMAND_NAMES = {CMD_WVCLR: 'WVCLR', CMD_WVAG: 'WVAG', CMD_WVBSY: 'WVBSY', CMD_WVHLT: 'WVHLT', CMD_WVCRE: 'WVCRE',
+                 CMD_WVDEL: 'WVDEL', CMD_WVNEW: 'WVNEW', CMD_WVTXM: 'WVTXM', CMD_WVTAT: 'WVTAT'}
+
+
+class FakePigpiod:
+    """
+    Serves the pigpiod protocol on 127.0.0.1:port (0 picks a free one) from daemon threads.
+    'edges' counts the rising edges played per BCM gpio and 'log' keeps (client, command, p1)
+    of every wave command in the order they arrived.
+    """
+
+    def __init__(self, port: int=0):
+        self.server = socket.socket()
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('127.0.0.1', port))
+        self.server.listen()
+        self.port = self.server.getsockname()[1]
+        self.lock = threading.Lock()
+        self.pulses = []        # (on mask, off mask, delay in us) added since the last WVNEW
+        self.waves = {}         # wave id -> (duration in s, [(offset in s, on mask)])
+        self.on_air = []        # [wave id, start time], the first one is playing
+        self.levels = 0         # bank of gpio levels set by writes
+        self.edges = Counter()
+        self.log = []
+        self.clients = 0
+
+    def start(self):
+        threading.Thread(target=self.serve, name='fake-pigpiod', daemon=True).start()
+        return self
+
+    def serve(self):
+        while True:
+            conn, _ = self.server.accept()
+            self.clients += 1
+            threading.Thread(target=self.handle, args=(conn, self.clients), daemon=True).start()
+
+    def handle(self, conn: socket.socket, client: int):
+        with conn:
+            while True:
+                header = self.read(conn, 16)
+                if header is None:
+                    return
+                cmd, p1, p2, length = struct.unpack('<IIII', header)
+                extension = self.read(conn, length) if length else b''
+                if extension is None:
+                    return
+                with self.lock:
+                    if cmd in COMMAND_NAMES and cmd not in (CMD_WVBSY, CMD_WVTAT):
+                        self.log.append((client, COMMAND_NAMES[cmd], p1))
+                    result = self.command(cmd, p1, p2, extension)
+                conn.sendall(struct.pack('<IIIi', cmd, p1, p2, result))
+
+    @staticmethod
+    def read(conn: socket.socket, size: int):
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def command(self, cmd: int, p1: int, p2: int, extension: bytes) -> int:
+        now = time.monotonic()
+        self.advance(now)
+        if cmd == CMD_WRITE:
+            self.set_levels(self.levels | 1 << p1 if p2 else self.levels & ~(1 << p1))
+        elif cmd == CMD_BS1:
+            self.set_levels(self.levels | p1)
+        elif cmd == CMD_BC1:
+            self.set_levels(self.levels & ~p1)
+        elif cmd == CMD_WVNEW:
+            self.pulses = []
+        elif cmd == CMD_WVAG:
+            self.pulses += struct.iter_unpack('<III', extension)
+            return len(self.pulses)
+        elif cmd == CMD_WVCRE:
+            if not self.pulses:
+                return PI_EMPTY_WAVEFORM
+            wave = min(set(range(len(self.waves) + 1)) - set(self.waves))
+            offset, rising = 0, []
+            for on, _, delay in self.pulses:
+                if on:
+                    rising.append((offset / 1e6, on))
+                offset += delay
+            self.waves[wave] = (offset / 1e6, rising)
+            self.pulses = []
+            return wave
+        elif cmd == CMD_WVDEL:
+            if p1 not in self.waves or any(wave == p1 for wave, _ in self.on_air):
+                return PI_BAD_WAVE_ID
+            del self.waves[p1]
+        elif cmd == CMD_WVTXM:
+            if p1 not in self.waves:
+                return PI_BAD_WAVE_ID
+            if not self.on_air:
+                self.on_air.append([p1, now])
+            else:
+                # sync mode, starts when the one on air finishes; a new sync wave replaces a queued one
+                del self.on_air[1:]
+                self.on_air.append([p1, None])
+        elif cmd == CMD_WVTAT:
+            return self.on_air[0][0] if self.on_air else NO_TX_WAVE
+        elif cmd == CMD_WVBSY:
+            return int(bool(self.on_air))
+        elif cmd == CMD_WVHLT:
+            self.halt(now)
+        elif cmd == CMD_WVCLR:
+            self.halt(now)
+            self.waves.clear()
+        return 0
+
+    def advance(self, now: float):
+        """Finish the waves that have played out by now and start the one queued behind them"""
+        while self.on_air:
+            wave, start = self.on_air[0]
+            duration, rising = self.waves[wave]
+            if start + duration > now:
+                return
+            self.count(rising, duration)
+            self.on_air.pop(0)
+            if self.on_air:
+                self.on_air[0][1] = start + duration
+
+    def halt(self, now: float):
+        if self.on_air:
+            wave, start = self.on_air[0]
+            self.count(self.waves[wave][1], now - start)
+        self.on_air = []
+
+    def set_levels(self, levels: int):
+        self.count_mask(levels & ~self.levels)
+        self.levels = levels
+
+    def count(self, rising: list, elapsed: float):
+        for offset, mask in rising:
+            if offset > elapsed:
+                break
+            self.count_mask(mask)
+
+    def count_mask(self, mask: int):
+        for gpio in range(32):
+            if mask >> gpio & 1:
+                self.edges[gpio] += 1
+
+
+def check(daemon: FakePigpiod, steps: int) -> bool:
+    """Both steppers at once, the way Sequence and the command server run them"""
+    os.environ['PIGPIO_PORT'] = str(daemon.port)
+    import GPIOBackend
+    GPIOBackend.select('pigpio')
+    import MotorClass as mc
+
+    steppers = [mc.Stepper(11, 13), mc.Stepper(33, 35)]
+    made = {}
+
+    def run(stepper):
+        made[stepper.step_pin] = stepper.move_motor(steps, 0.0005)
+
+    threads = [threading.Thread(target=run, args=(stepper,)) for stepper in steppers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ok = True
+    for stepper in steppers:
+        played = daemon.edges[GPIOBackend.BOARD_TO_BCM[stepper.step_pin]]
+        ok &= played == made[stepper.step_pin] == steps
+        print(f"Stepper on pin {stepper.step_pin}: reported {made[stepper.step_pin]}, played {played}")
+    print(f"Leftover waves: {len(daemon.waves)}")
+    return ok and not daemon.waves
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in for the pigpiod daemon")
+    parser.add_argument('--port', type=int, default=8888, help="port to listen on, 0 picks a free one")
+    parser.add_argument('--check', type=int, metavar='STEPS', nargs='?', const=3000,
+                        help="move both steppers STEPS steps at once against the stand-in and exit")
+    args = parser.parse_args()
+
+    daemon = FakePigpiod(0 if args.check else args.port).start()
+    if args.check:
+        raise SystemExit(0 if check(daemon, args.check) else 1)
+    print(f"Fake pigpiod listening on 127.0.0.1:{daemon.port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,8 @@
 import MotorClass
-import RPi.GPIO as GPIO
+from MotorClass import GPIO
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')  # show the motor messages on the console
 
 LEFT_STEP = MotorClass.Stepper(38, 40)
 LEFT_FLANGE = MotorClass.SmallServo(32)
@@ -1,26 +1,33 @@
-import RPi.GPIO as GPIO
+from MotorClass import GPIO
 import MotorClass
 import time
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')  # show the motor messages on the console
+
+# Actuators are only set up when first used (or by MotorClass.arm), so the ones
+# still waiting for pins below do not stop the script from starting
+Lazy = MotorClass.LazyActuator
 
 # Left Torque Arm Actuators
-LEFT_STEP = MotorClass.Stepper(38, 40)
-LEFT_FLANGE = MotorClass.SmallServo(32)
-LEFT_ELEVATOR = MotorClass.ServoMotor(28)
+LEFT_STEP = Lazy(MotorClass.Stepper, 38, 40)
+LEFT_FLANGE = Lazy(MotorClass.SmallServo, 32)
+LEFT_ELEVATOR = Lazy(MotorClass.ServoMotor, 28)
 
 # Left Node Magazine
-LEFT_TRAY = MotorClass.DCMotor(35, 37)
+LEFT_TRAY = Lazy(MotorClass.DCMotor, 35, 37)
 
 # Right Torque Arm Actuators
-RIGHT_STEPPER = MotorClass.Stepper(...)
-RIGHT_FLANGE = MotorClass.SmallServo(...)
-RIGHT_ELEVATOR = MotorClass.ServoMotor(...)
+RIGHT_STEPPER = Lazy(MotorClass.Stepper, ...)
+RIGHT_FLANGE = Lazy(MotorClass.SmallServo, ...)
+RIGHT_ELEVATOR = Lazy(MotorClass.ServoMotor, ...)
 
 # Right Node Magazine
-RIGHT_TRAY = MotorClass.DCMotor(...)
+RIGHT_TRAY = Lazy(MotorClass.DCMotor, ...)
 
 # Beam magazine
-LEAD_SCREW = MotorClass.DCMotor(...)
-SEP_MOD = MotorClass.DCMotor(...)
+LEAD_SCREW = Lazy(MotorClass.DCMotor, ...)
+SEP_MOD = Lazy(MotorClass.DCMotor, ...)
 
 
 def wait():
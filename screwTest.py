@@ -1,6 +1,6 @@
 import MotorClass
 import time
-import RPi.GPIO as GPIO
+from MotorClass import GPIO
 
 def main():
     try:
@@ -0,0 +1,66 @@
+"""
+This script runs any of our motor scripts on the virtual clock GPIO simulator, so a whole
+assembly sequence can be checked on a normal computer in a fraction of the real time.
+
+Answers to the script's input() prompts are given on the command line in order, e.g.
+
+    python simulate.py left_test.py 50 2 y 80 y 20 y 10 y 50 2 y 0
+
+At the end it prints the simulated run time, how many pin events were recorded and where
+every stepper and servo ended up. --events FILE also writes every recorded event as CSV.
+"""
+
+import argparse
+import builtins
+import csv
+import runpy
+import time
+
+import GPIOBackend
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a motor script on the simulated GPIO backend")
+    parser.add_argument('script', help="script to run, e.g. left_test.py")
+    parser.add_argument('answers', nargs='*', help="answers to the script's input() prompts, in order")
+    parser.add_argument('--events', help="write the recorded pin events to this CSV file")
+    args = parser.parse_args()
+
+    GPIOBackend.select('virtual')
+    gpio = GPIOBackend.load()
+    answers = list(args.answers)
+
+    def scripted_input(prompt=''):
+        if not answers:
+            raise SystemExit(f"Script asked '{prompt}' but no answers are left")
+        answer = answers.pop(0)
+        print(f"{prompt}{answer}")
+        return answer
+
+    builtins.input = scripted_input
+    wall_start = time.perf_counter()
+    try:
+        runpy.run_path(args.script, run_name='__main__')
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            print(e.code)
+    wall = time.perf_counter() - wall_start
+
+    print(f"\nSimulated time: {gpio.clock.monotonic():.3f} s, wall clock: {wall * 1e3:.1f} ms")
+    print(f"Recorded events: {len(gpio.events)}")
+    for step_pin, (dir_pin, position) in sorted(gpio.steppers.items()):
+        print(f"Stepper on pins {step_pin}/{dir_pin}: {position} steps")
+    for pin in sorted(gpio.servos):
+        angle = gpio.servo_angle(pin)
+        if angle is not None:
+            print(f"Servo on pin {pin}: {angle:.1f} deg")
+
+    if args.events:
+        with open(args.events, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['time_ns', 'pin', 'kind', 'value'])
+            writer.writerows(gpio.events)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,10 @@ This is a test script to understand how the stepper motors work in RPi.GPIO
 
 import MotorClass
 import time
-import RPi.GPIO as GPIO
+from MotorClass import GPIO
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')  # show the motor messages on the console
 
 def main():
     try:
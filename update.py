@@ -2,24 +2,203 @@
 This script will be used to update the Raspberry Pi using crontab
 
 THIS PROCESS IS CRUCIAL, PLEASE DO NOT EDIT WITHOUT TALKING TO ETHAN
+
+Updates are staged instead of pulled into the tree the controller is running from:
+    1. fetch the new commits into the repo, only .git changes, no working files
+    2. export the commit into its own release directory, RELEASES_PATH/<commit>
+    3. compile every module to bytecode so the next start does not have to
+    4. import the modules and build one actuator of each kind on the simulated GPIO backend
+    5. point the RELEASES_PATH/current symlink at the new release with a single rename
+    6. send RESTART_SIGNAL to the running controller, it restarts into 'current' as soon
+       as nothing is moving (see MotorControlGUI.check_restart)
+A release that fails step 3 or 4 is deleted and 'current' is left alone. The controller has to
+be started as RELEASES_PATH/current/GUIclass.py to pick up updates. The last KEEP_RELEASES
+releases are kept, so going back is just pointing 'current' at an older one.
 """
 
-import subprocess
+import io
 import os
+import shutil
+import signal
+import subprocess
+import sys
+import tarfile
+
+repo_path = "/home/EthansPi/COSMIC"
+RELEASES_PATH = "/home/EthansPi/COSMIC-releases"
+CURRENT = os.path.join(RELEASES_PATH, "current")
+KEEP_RELEASES = 3
+GIT = "/usr/bin/git"
+
+PID_FILE = os.path.join(os.path.expanduser('~'), '.cosmic', 'controller.pid')   # written by the GUI
+CONTROLLER_SCRIPT = "GUIclass.py"      # a pid is only signalled if its command line runs this
+RESTART_SIGNAL = signal.SIGUSR1
+SMOKE_TIMEOUT = 60      # seconds
+
+# library modules only, the test scripts move motors as soon as they are imported
+SMOKE_MODULES = ('GPIOBackend', 'MotorClass', 'CommandQueue', 'Telemetry', 'Metrics', 'StateStore',
+                 'FlightRecorder', 'MotionProcess', 'Sequence', 'CycleTime', 'GUIclass')
+SMOKE_TEST = f"""
+import importlib
+for name in {SMOKE_MODULES!r}:
+    importlib.import_module(name)
+import MotorClass as mc
+mc.Stepper(11, 13).move_motor(10, 0.0001)
+mc.ServoMotor(16).change_pos(10, direct=True)
+mc.SmallServo(15).change_pos(20, direct=True)
+mc.DCMotor(29, 31).move_motor(50, 0.01)
+mc.Solenoid(7).open()
+mc.GPIO.cleanup()
+"""
+
+
+def git(*args) -> str:
+    result = subprocess.run([GIT, "-C", repo_path, *args], capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
+def fetch() -> str:
+    """Fetch the tracked branch and return the commit it is at"""
+    git("fetch", "--quiet")
+    return git("rev-parse", "@{u}")
+
+
+def current_release() -> str:
+    """Directory 'current' points at, None before the first staged update"""
+    return os.path.realpath(CURRENT) if os.path.islink(CURRENT) else None
+
+
+def export(commit: str) -> str:
+    """Unpack the files of a commit into a new release directory, returns its path"""
+    release = os.path.join(RELEASES_PATH, commit[:12])
+    staging = release + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    archive = subprocess.run([GIT, "-C", repo_path, "archive", commit], capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(staging)
+    return staging
+
+
+def check(staging: str):
+    """Precompile and smoke test a release, raises CalledProcessError if either fails"""
+    subprocess.run([sys.executable, "-m", "compileall", "-q", staging], check=True)
+    env = {key: value for key, value in os.environ.items() if not key.startswith("COSMIC_")}
+    env["COSMIC_GPIO_BACKEND"] = "sim"      # no pins are touched, and no state file is written
+    subprocess.run([sys.executable, "-c", SMOKE_TEST], cwd=staging, env=env, check=True,
+                   capture_output=True, text=True, timeout=SMOKE_TIMEOUT)
+
+
+def switch(release: str):
+    """Point 'current' at release. The rename replaces the old link in one step"""
+    link = CURRENT + ".tmp"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(release, link)
+    os.replace(link, CURRENT)
 
-def git_pull():
-    # Set the working directory to the Git repo
-    repo_path = "/home/EthansPi/COSMIC"
-    os.chdir(repo_path)
 
+def write_pid():
+    """Called by the controller once it handles RESTART_SIGNAL"""
+    os.makedirs(os.path.dirname(PID_FILE), exist_ok=True)
+    with open(PID_FILE, 'w') as f:
+        f.write(str(os.getpid()))
+
+
+def remove_pid():
+    """Called by the controller when it exits, leaves a file written by another process alone"""
+    try:
+        with open(PID_FILE) as f:
+            if int(f.read()) != os.getpid():
+                return
+        os.remove(PID_FILE)
+    except (OSError, ValueError):
+        pass
+
+
+def is_controller(pid: int) -> bool:
+    """
+    True if pid is running CONTROLLER_SCRIPT. A pid file left behind by a crash can name an
+    unrelated process by now, and RESTART_SIGNAL would kill it.
+    """
+    try:
+        with open(f"/proc/{pid}/cmdline", 'rb') as f:
+            args = f.read().split(b'\0')
+    except OSError:
+        return False
+    return any(os.path.basename(arg.decode(errors='replace')) == CONTROLLER_SCRIPT for arg in args)
+
+
+def signal_controller() -> bool:
+    """Ask the running controller to restart, False if none is running"""
+    try:
+        with open(PID_FILE) as f:
+            pid = int(f.read())
+    except (OSError, ValueError):
+        return False
+    if not is_controller(pid):
+        print(f"Ignoring stale pid file {PID_FILE} (pid {pid} is not the controller)")
+        try:
+            os.remove(PID_FILE)
+        except OSError:
+            pass
+        return False
     try:
-    
-        result = subprocess.run(["/usr/bin/git", "pull"], capture_output=True, text=True)
-        print(result.stdout)
-        print("This should have been successful")
-        print(result.stderr)
-    except:
-        print("there was an error")
+        os.kill(pid, RESTART_SIGNAL)
+    except OSError:
+        return False
+    return True
+
+
+def prune(keep: int=KEEP_RELEASES):
+    """Delete all but the newest 'keep' releases, never the current one"""
+    current = current_release()
+    releases = [os.path.join(RELEASES_PATH, name) for name in os.listdir(RELEASES_PATH)
+                if name != os.path.basename(CURRENT)]
+    releases = [path for path in releases if os.path.isdir(path) and not os.path.islink(path)]
+    releases.sort(key=os.path.getmtime, reverse=True)
+    for path in releases[keep:]:
+        if os.path.realpath(path) != current:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def update() -> bool:
+    """Stage, check and switch to the newest commit, see the module docstring"""
+    os.makedirs(RELEASES_PATH, exist_ok=True)
+    try:
+        commit = fetch()
+    except subprocess.CalledProcessError as e:
+        print(f"Fetch failed: {e.stderr}")
+        return False
+    release = os.path.join(RELEASES_PATH, commit[:12])
+    if current_release() == os.path.realpath(release):
+        print(f"Already at {commit[:12]}")
+        return True
+
+    staging = export(commit)
+    try:
+        check(staging)
+    except subprocess.CalledProcessError as e:
+        print(f"Release {commit[:12]} failed its checks, keeping the current one")
+        print(e.stdout or '', e.stderr or '')
+        shutil.rmtree(staging, ignore_errors=True)
+        return False
+    except subprocess.TimeoutExpired:
+        print(f"Release {commit[:12]} smoke test did not finish in {SMOKE_TIMEOUT} s, keeping the current one")
+        shutil.rmtree(staging, ignore_errors=True)
+        return False
+
+    shutil.rmtree(release, ignore_errors=True)  # left over from an earlier attempt
+    os.replace(staging, release)
+    switch(release)
+    print(f"Switched to {commit[:12]}")
+    if signal_controller():
+        print("Controller will restart once it is idle")
+    else:
+        print("No controller running, the new release is used on the next start")
+    prune()
+    return True
+
 
 if __name__ == "__main__":
-    git_pull()
\ No newline at end of file
+    sys.exit(0 if update() else 1)